@@ -0,0 +1,87 @@
+# Benchmark the ETA models on padded vs packed / masked sequences
+#
+# Usage: python benchmark_models.py --data ../data/token_traj_chengdu_4d.tokens --model transformer
+import argparse
+import time
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from dataset import LengthBucketSampler, ResampleCollate, TrajectoryDataset, trim_collate
+from models import build_model
+
+
+def run(model, loader, n_batches, use_lengths, max_length, device, train=True):
+    """
+    Run n_batches training (or inference) steps and return the number of samples per second.
+    """
+    criterion = nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    model.train(train)
+    n_samples, elapsed = 0, 0.0
+    for i, (x_batch, y_batch, lengths) in enumerate(loader):
+        if i == n_batches:
+            break
+        if not use_lengths:
+            # 原始做法: 补零到 max_length, 模型处理所有时间步
+            x_batch = nn.functional.pad(x_batch, (0, 0, 0, max_length - x_batch.size(1)))
+        x_batch, y_batch = x_batch.to(device), y_batch.to(device)
+        args = (lengths,) if use_lengths else ()
+        tic = time.perf_counter()
+        if train:
+            optimizer.zero_grad()
+            loss = criterion(model(x_batch, *args), y_batch)
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad():
+                model(x_batch, *args)
+        elapsed += time.perf_counter() - tic
+        n_samples += len(y_batch)
+    return n_samples / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Samples/second of the ETA models on padded vs length-aware input")
+    parser.add_argument("--data", default="../data/token_traj_chengdu_4d.tokens")
+    parser.add_argument("--model", choices=["lstm", "forward_lstm", "transformer"], default="lstm")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=20, help="steps per measurement")
+    parser.add_argument("--resample", type=int, default=None, help="also measure with sequences capped at this length")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    dataset = TrajectoryDataset(args.data, return_lengths=True)
+    input_dim = dataset.meta["input_dim"] + 1
+    max_length = dataset.meta["max_length"]
+    skip = "masked" if args.model == "transformer" else "packed"
+
+    modes = [
+        ("padded", False, None, trim_collate),
+        (skip, True, None, trim_collate),
+        (f"{skip} + length buckets", True, True, trim_collate),
+    ]
+    if args.resample:
+        modes.append((f"{skip} + buckets + resample {args.resample}", True, True, ResampleCollate(args.resample)))
+
+    results = {}
+    for name, use_lengths, bucketing, collate_fn in modes:
+        for train in (True, False):
+            torch.manual_seed(0)
+            model = build_model(args.model, input_dim).to(device)
+            if bucketing:
+                sampler = LengthBucketSampler(dataset.lengths, batch_size=args.batch_size)
+                loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+            else:
+                loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
+            results[name, train] = run(model, loader, args.batches, use_lengths, max_length, device, train=train)
+
+    print(f"{args.model}: {'mode':<36}{'train/s':>10}{'speedup':>9}{'infer/s':>10}{'speedup':>9}")
+    for name, _, _, _ in modes:
+        train_rate, infer_rate = results[name, True], results[name, False]
+        print(f"{'':<{len(args.model) + 2}}{name:<36}{train_rate:>10.1f}{train_rate / results['padded', True]:>8.1f}x"
+              f"{infer_rate:>10.1f}{infer_rate / results['padded', False]:>8.1f}x")
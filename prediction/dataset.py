@@ -0,0 +1,261 @@
+# Datasets, collate functions and samplers for the tokenized trajectories written by utils/traj_token.py
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+
+class TrajectoryDataset(Dataset):
+    """
+    Padded trajectories from the tensor folder written by traj_token.py --format npy.
+
+    The arrays are memory-mapped copy-on-write and opened lazily in each process,
+    so DataLoader workers never pickle the data and `__getitem__` returns tensor
+    views of the mapped file without copying. Memory use is proportional to the
+    batches being read, not to the dataset.
+
+    Args:
+        data_path (str): Folder with tokens.npy, time_elapsed.npy, lengths.npy and meta.json.
+        max_rows (int): Only use the first max_rows trajectories, None for all.
+        return_lengths (bool): Also return the true length of each trajectory, for
+            models that skip the padding (see `trim_collate`).
+    """
+    def __init__(self, data_path, max_rows=None, return_lengths=False):
+        self.data_path = data_path
+        self.return_lengths = return_lengths
+        with open(os.path.join(data_path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.n_rows = self.meta["n_trips"] if max_rows is None else min(max_rows, self.meta["n_trips"])
+        self.lengths = np.load(os.path.join(data_path, "lengths.npy"))[:self.n_rows]
+        self._x = None
+        self._y = None
+
+    def _open(self):
+        # mode "c": 可写的 copy-on-write 映射, torch.from_numpy 不会因只读数组报警告
+        self._x = np.load(os.path.join(self.data_path, "tokens.npy"), mmap_mode="c")
+        self._y = np.load(os.path.join(self.data_path, "time_elapsed.npy"), mmap_mode="c")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_x"] = None
+        state["_y"] = None
+        return state
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, idx):
+        if self._x is None:
+            self._open()
+        x = torch.from_numpy(self._x[idx])
+        y = torch.from_numpy(self._y[idx:idx + 1]).squeeze(0)
+        if self.return_lengths:
+            return x, y, int(self.lengths[idx])
+        return x, y
+
+
+class PackedTrajectoryDataset(Dataset):
+    """
+    Trajectories stored without padding (traj_token.py --format packed), opened
+    lazily and memory-mapped like `TrajectoryDataset`.
+
+    Args:
+        data_path (str): Folder with tokens.npy, offsets.npy, time_elapsed.npy and meta.json.
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        with open(os.path.join(data_path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(data_path, "offsets.npy"))
+        self.y = np.load(os.path.join(data_path, "time_elapsed.npy"))
+        self.lengths = np.diff(self.offsets)
+        self._tokens = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, idx):
+        if self._tokens is None:
+            self._tokens = np.load(os.path.join(self.data_path, "tokens.npy"), mmap_mode="c")
+        x = torch.from_numpy(self._tokens[self.offsets[idx]:self.offsets[idx + 1]])
+        y = torch.tensor(self.y[idx], dtype=torch.float32)
+        return x, y
+
+
+def pad_collate(batch, return_lengths=False):
+    """
+    Pad a batch of variable-length trajectories to the longest one in the batch.
+
+    Args:
+        batch (list): (x, y) pairs, x of shape (length, input_dim + 1).
+        return_lengths (bool): Also return the true lengths, e.g. for packed sequences.
+
+    Returns:
+        tuple: x (batch, longest, input_dim + 1), y (batch,) and optionally lengths (batch,).
+    """
+    xs, ys = zip(*batch)
+    lengths = torch.tensor([len(x) for x in xs], dtype=torch.int64)
+    x = torch.nn.utils.rnn.pad_sequence(xs, batch_first=True)
+    y = torch.stack(ys)
+    if return_lengths:
+        return x, y, lengths
+    return x, y
+
+
+def pad_collate_with_lengths(batch):
+    return pad_collate(batch, return_lengths=True)
+
+
+def trim_collate(batch):
+    """
+    Collate (x, y, length) samples of a padded dataset and cut the batch down to
+    its own longest trajectory.
+
+    Returns:
+        tuple: x (batch, longest, input_dim + 1), y (batch,), lengths (batch,).
+    """
+    xs, ys, lengths = zip(*batch)
+    lengths = torch.tensor(lengths, dtype=torch.int64)
+    # 先把每条样本切到本批最长长度再拼接, 不从 memmap 读出整行 max_length 的填充
+    longest = int(lengths.max())
+    x = torch.stack([x[:longest] for x in xs])
+    return x, torch.stack(ys), lengths
+
+
+def resample_batch(x, lengths, max_length):
+    """
+    Cap a padded batch at max_length steps. Trajectories longer than max_length are
+    resampled to max_length evenly spaced steps, always keeping the first (start token)
+    and last (end token) step; shorter ones are left as they are.
+
+    Returns:
+        tuple: x (batch, min(max_length, seq_length), dim) and the new lengths.
+    """
+    cap = min(max_length, x.size(1))
+    steps = torch.arange(cap, dtype=torch.float64)
+    scale = torch.where(lengths > cap, (lengths - 1).double() / (cap - 1), torch.ones_like(lengths, dtype=torch.float64))
+    index = torch.round(steps[None, :] * scale[:, None]).long().clamp(max=x.size(1) - 1)
+    x = torch.gather(x, 1, index[:, :, None].expand(-1, -1, x.size(2)))
+    return x, lengths.clamp(max=cap)
+
+
+class ResampleCollate:
+    """
+    Collate function capping every batch at max_length steps with `resample_batch`.
+
+    Args:
+        max_length (int): Longest sequence fed to the model.
+        collate_fn (callable): Base collate returning (x, y, lengths), e.g. `trim_collate`
+            or `pad_collate_with_lengths`.
+    """
+    def __init__(self, max_length, collate_fn=trim_collate):
+        self.max_length = max_length
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        x, y, lengths = self.collate_fn(batch)
+        x, lengths = resample_batch(x, lengths, self.max_length)
+        return x, y, lengths
+
+
+class PrefixCollate:
+    """
+    Collate function cutting trajectories to random prefixes, for models that predict
+    the trip duration while the trip is still running (see streaming.py). A cut
+    trajectory keeps its start token and first k points but loses the end token; the
+    target stays the duration of the whole trip.
+
+    Args:
+        prefix_fraction (float): Share of the trajectories that are cut.
+        collate_fn (callable): Base collate returning (x, y, lengths).
+    """
+    def __init__(self, prefix_fraction=0.5, collate_fn=trim_collate):
+        self.prefix_fraction = prefix_fraction
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        x, y, lengths = self.collate_fn(batch)
+        n_points = lengths - 2
+        cut = (torch.rand(len(lengths)) < self.prefix_fraction) & (n_points > 0)
+        # k 在 [1, n_points] 中均匀抽取, 截断后长度为 k + 1 (起始 token + k 个点)
+        k = (torch.rand(len(lengths)) * n_points).long() + 1
+        lengths = torch.where(cut, k + 1, lengths)
+        x = x[:, :int(lengths.max())].clone()
+        x[torch.arange(x.size(1))[None, :] >= lengths[:, None]] = 0
+        return x, y, lengths
+
+
+def subset_lengths(dataset):
+    """
+    Sequence lengths of a dataset or of a `Subset` of it (e.g. from `random_split`).
+    """
+    if isinstance(dataset, torch.utils.data.Subset):
+        return subset_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    return np.asarray(dataset.lengths)
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler grouping trajectories of similar length, so that padding each
+    batch to its own longest sequence wastes little compute.
+
+    Indices are shuffled, cut into buckets of `batch_size * bucket_batches`, sorted
+    by length inside each bucket and split into batches; the batch order is shuffled
+    again so training does not see lengths in a fixed order.
+
+    Args:
+        lengths (array-like): Sequence length of every sample.
+        batch_size (int): Samples per batch.
+        bucket_batches (int): Number of batches sorted together.
+        shuffle (bool): Shuffle samples and batches each epoch.
+        drop_last (bool): Drop the last incomplete batch of every bucket.
+        seed (int): Base seed, combined with the epoch counter (advanced on every
+            iteration, or set explicitly with `set_epoch`).
+    """
+    def __init__(self, lengths, batch_size=32, bucket_batches=100, shuffle=True, drop_last=False, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        bucket_size = self.batch_size * self.bucket_batches
+        batches = []
+        for start in range(0, len(indices), bucket_size):
+            bucket = indices[start:start + bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            for b in range(0, len(bucket), self.batch_size):
+                batch = bucket[b:b + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        batches = self._batches()
+        # 未调用 set_epoch 时也保证每个 epoch 的顺序不同
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        n_buckets, rest = divmod(len(self.lengths), self.batch_size * self.bucket_batches)
+        if self.drop_last:
+            return n_buckets * self.bucket_batches + rest // self.batch_size
+        return n_buckets * self.bucket_batches + -(-rest // self.batch_size)
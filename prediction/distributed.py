@@ -0,0 +1,108 @@
+# CPU data-parallel training of the ETA models: N local processes, gloo backend, gradients averaged by DDP
+#
+# Usage: python distributed.py --procs 8 --data ../data/token_traj_chengdu_4d.tokens --model lstm --lengths
+#        python distributed.py --scaling 1 2 4 8 --epochs 1 --max-rows 200000   # scaling efficiency table
+# Every process trains on its own shard of the memory-mapped training split; rank 0 validates,
+# prints and tests. Only localhost is used, no GPU is needed.
+import argparse
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Subset
+
+from dataset import TrajectoryDataset, trim_collate
+from engine import add_engine_args, make_loader, split_dataset, test_model, train_model
+from models import build_model
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def shard(dataset, rank, world_size):
+    """
+    Every world_size-th sample starting at rank, cut so that all shards have the same
+    size: DDP needs the same number of batches on every process.
+    """
+    n = len(dataset) // world_size * world_size
+    return Subset(dataset, range(rank, n, world_size))
+
+
+def worker(rank, world_size, port, args, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // world_size))
+    torch.manual_seed(args.seed)
+
+    # 每个进程各自打开 memmap, 数据不经过进程间复制
+    dataset = TrajectoryDataset(args.data, max_rows=args.max_rows, return_lengths=args.lengths)
+    train_set, val_set, test_set = split_dataset(dataset, seed=args.seed)
+    loader_options = {"batch_size": args.batch_size, "num_workers": args.workers, "prefetch_factor": args.prefetch,
+                      "bucket": args.lengths, "collate_fn": trim_collate if args.lengths else None}
+    train_loader = make_loader(shard(train_set, rank, world_size), shuffle=True, **loader_options)
+    # 验证只在 rank 0 上进行, 其他进程传入空列表
+    val_loader = make_loader(val_set, **loader_options) if rank == 0 else []
+
+    input_dim = dataset.meta["input_dim"] + 1
+    config = {"model": args.model, "input_dim": input_dim}
+    model = DistributedDataParallel(build_model(args.model, input_dim))
+    history = train_model(model, train_loader, val_loader, epochs=args.epochs, lr=args.lr,
+                          accumulation_steps=args.accumulate, checkpoint_path=args.checkpoint,
+                          resume=args.resume, config=config, verbose=rank == 0)
+    results.put((rank, [epoch["train"]["samples/s"] for epoch in history]))
+
+    if rank == 0 and not args.no_test:
+        test_model(model.module, make_loader(test_set, **loader_options))
+    dist.destroy_process_group()
+
+
+def launch(args, world_size):
+    """
+    Train with world_size processes.
+
+    Returns:
+        tuple: (training samples/s summed over the processes, averaged over the epochs, wall seconds).
+    """
+    context = mp.get_context("spawn")
+    results = context.SimpleQueue()
+    tic = time.perf_counter()
+    mp.spawn(worker, args=(world_size, free_port(), args, results), nprocs=world_size, join=True)
+    elapsed = time.perf_counter() - tic
+    rates = [results.get()[1] for _ in range(world_size)]
+    per_epoch = [sum(rank_rates[epoch] for rank_rates in rates) for epoch in range(len(rates[0]))]
+    return sum(per_epoch) / max(len(per_epoch), 1), elapsed
+
+
+if __name__ == "__main__":
+    parser = add_engine_args(argparse.ArgumentParser(description="Data-parallel CPU training with torch.distributed"))
+    parser.add_argument("--procs", type=int, default=2, help="local training processes")
+    parser.add_argument("--scaling", type=int, nargs="+", default=None,
+                        help="train once per process count and report the scaling efficiency")
+    parser.add_argument("--no-test", action="store_true", help="skip the test split after training")
+    args = parser.parse_args()
+    if args.bf16 or args.prefixes:
+        parser.error("--bf16 and --prefixes are not supported by the distributed launcher")
+
+    if args.scaling is None:
+        rate, elapsed = launch(args, args.procs)
+        print(f"{args.procs} processes: {rate:.1f} training samples/s, {elapsed:.1f}s")
+    else:
+        args.no_test = True
+        args.checkpoint = None
+        rates = {}
+        for world_size in args.scaling:
+            rates[world_size], elapsed = launch(args, world_size)
+            print(f"{world_size} processes: {rates[world_size]:.1f} training samples/s, {elapsed:.1f}s")
+        base = args.scaling[0]
+        print(f"{'procs':>6}{'samples/s':>12}{'speedup':>10}{'efficiency':>12}")
+        for world_size, rate in rates.items():
+            speedup = rate / rates[base]
+            print(f"{world_size:>6}{rate:>12.1f}{speedup:>10.2f}{speedup * base / world_size:>12.0%}")
@@ -0,0 +1,275 @@
+# Training / evaluation engine for the ETA models, shared by the notebooks and the command line
+#
+# Usage: python engine.py --data ../data/token_traj_chengdu_4d.tokens --model lstm --lengths --workers 4
+import argparse
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.utils.data import DataLoader, random_split
+from tqdm import tqdm
+
+from dataset import LengthBucketSampler, PrefixCollate, TrajectoryDataset, subset_lengths, trim_collate
+from models import build_model
+
+
+def mape_loss(y_true, y_pred):
+    return torch.mean(torch.abs((y_true - y_pred) / y_true))
+
+
+def split_dataset(dataset, seed=0):
+    """
+    Split the dataset into train/val/test = 7/1/2, reproducibly so a resumed run sees the same split.
+    """
+    train_size = int(0.7 * len(dataset))
+    val_size = int(0.1 * len(dataset))
+    test_size = len(dataset) - train_size - val_size
+    generator = torch.Generator().manual_seed(seed)
+    return random_split(dataset, [train_size, val_size, test_size], generator=generator)
+
+
+def make_loader(dataset, batch_size=32, shuffle=False, num_workers=0, prefetch_factor=2,
+                pin_memory=False, bucket=False, collate_fn=None):
+    """
+    DataLoader with the worker, prefetch and pinned-memory settings of the engine.
+
+    Args:
+        bucket (bool): Group trajectories of similar length with `LengthBucketSampler`;
+            the dataset must expose lengths (e.g. TrajectoryDataset(return_lengths=True)).
+    """
+    options = {"num_workers": num_workers, "pin_memory": pin_memory, "collate_fn": collate_fn}
+    if num_workers > 0:
+        options["prefetch_factor"] = prefetch_factor
+        options["persistent_workers"] = True
+    if bucket:
+        sampler = LengthBucketSampler(subset_lengths(dataset), batch_size=batch_size, shuffle=shuffle)
+        return DataLoader(dataset, batch_sampler=sampler, **options)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **options)
+
+
+def _unpack(batch, device, non_blocking=False):
+    # batch 为 (x, y) 或带真实长度的 (x, y, lengths)
+    x_batch, y_batch, *lengths = batch
+    return x_batch.to(device, non_blocking=non_blocking), y_batch.to(device, non_blocking=non_blocking), lengths
+
+
+class Meter:
+    """
+    Running MSE / MAPE sums kept as tensors, so metrics cost no extra pass and no
+    per-batch device synchronisation; only `summary` calls .item().
+    """
+    def __init__(self, device):
+        self.sums = torch.zeros(2, dtype=torch.float64, device=device)
+        self.n = 0
+        self.data_time = 0.0
+        self.compute_time = 0.0
+
+    def update(self, y_true, y_pred):
+        y_pred = y_pred.detach().double()
+        y_true = y_true.double()
+        error = y_pred - y_true
+        self.sums += torch.stack([(error ** 2).sum(), (error / y_true).abs().sum()])
+        self.n += len(y_true)
+
+    def summary(self):
+        mse, mape = (self.sums / max(self.n, 1)).tolist()
+        elapsed = self.data_time + self.compute_time
+        return {"Loss": mse, "RMSE": float(np.sqrt(mse)), "MAPE": mape,
+                "samples/s": self.n / max(elapsed, 1e-9), "data s": self.data_time, "compute s": self.compute_time}
+
+
+def save_checkpoint(path, model, optimizer, epoch, config=None):
+    # DistributedDataParallel 包装的模型只保存内部模块, 检查点与单进程训练通用
+    model = getattr(model, "module", model)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                "epoch": epoch, "config": config or {}}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, model, optimizer=None, device="cpu"):
+    """
+    Restore model (and optimizer) state, returning the checkpoint dict.
+    """
+    checkpoint = torch.load(path, map_location=device)
+    getattr(model, "module", model).load_state_dict(checkpoint["model"])
+    if optimizer is not None:
+        optimizer.load_state_dict(checkpoint["optimizer"])
+    return checkpoint
+
+
+def evaluate(model, loader, device="cpu", bf16=False, desc="Testing", verbose=True):
+    """
+    MSE / RMSE / MAPE and throughput of the model over a loader.
+    """
+    device = torch.device(device)
+    model = model.to(device)
+    model.eval()
+    meter = Meter(device)
+    bar = tqdm(loader, desc=desc, disable=not verbose)
+    tic = time.perf_counter()
+    with torch.no_grad():
+        for batch in bar:
+            x_batch, y_batch, lengths = _unpack(batch, device)
+            loaded = time.perf_counter()
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                predictions = model(x_batch, *lengths)
+            meter.update(y_batch, predictions.float())
+            done = time.perf_counter()
+            meter.data_time += loaded - tic
+            meter.compute_time += done - loaded
+            tic = done
+    return meter.summary()
+
+
+def test_model(model, test_loader, device="cpu", bf16=False):
+    metrics = evaluate(model, test_loader, device=device, bf16=bf16, desc="Testing")
+    print("Test " + ", ".join(f"{key}: {value:.4f}" for key, value in metrics.items()))
+    return metrics
+
+
+def train_model(model, train_loader, val_loader, epochs=10, lr=0.001, device="cpu", bf16=False,
+                accumulation_steps=1, checkpoint_path=None, resume=False, config=None, log_every=20, verbose=True):
+    """
+    Train with MSE loss and Adam, validating after every epoch.
+
+    Args:
+        bf16 (bool): Run forward passes under CPU/GPU bfloat16 autocast.
+        accumulation_steps (int): Batches whose gradients are summed before each optimizer step.
+        checkpoint_path (str): Save model and optimizer state there after every epoch.
+        resume (bool): Continue from checkpoint_path if it exists.
+        config (dict): Stored in the checkpoint, e.g. the model name and sizes.
+        log_every (int): Batches between progress bar updates (each update synchronises).
+        verbose (bool): Show progress bars and per-epoch results (off on non-zero ranks of distributed.py).
+
+    Returns:
+        list: Per-epoch dicts with the train and validation metrics.
+    """
+    device = torch.device(device)
+    model = model.to(device)
+    criterion = nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+
+    # 分布式训练时只有 rank 0 写检查点; 恢复前先同步, 保证所有进程读到同一个完整文件
+    distributed = dist.is_available() and dist.is_initialized()
+    main_process = not distributed or dist.get_rank() == 0
+    if distributed and resume:
+        dist.barrier()
+    start_epoch = 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        start_epoch = load_checkpoint(checkpoint_path, model, optimizer, device)["epoch"] + 1
+        if verbose:
+            print(f"Resuming from {checkpoint_path} at epoch {start_epoch + 1}")
+
+    history = []
+    non_blocking = device.type == "cuda"
+    for epoch in range(start_epoch, epochs):
+        # Training phase
+        model.train()
+        sampler = getattr(train_loader, "batch_sampler", None)
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
+        meter = Meter(device)
+        train_bar = tqdm(train_loader, desc=f"Training Epoch {epoch+1}/{epochs}", disable=not verbose)
+        optimizer.zero_grad()
+        tic = time.perf_counter()
+        for step, batch in enumerate(train_bar):
+            x_batch, y_batch, lengths = _unpack(batch, device, non_blocking)
+            loaded = time.perf_counter()
+            update = (step + 1) % accumulation_steps == 0 or step + 1 == len(train_loader)
+            # DDP: 累积的中间步骤不做梯度 all-reduce, 只在更新参数的那一步同步
+            sync = nullcontext() if update or not hasattr(model, "no_sync") else model.no_sync()
+            with sync:
+                with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                    predictions = model(x_batch, *lengths)
+                loss = criterion(predictions.float(), y_batch)
+                (loss / accumulation_steps).backward()
+            if update:
+                optimizer.step()
+                optimizer.zero_grad()
+            meter.update(y_batch, predictions.float())
+            done = time.perf_counter()
+            meter.data_time += loaded - tic
+            meter.compute_time += done - loaded
+            tic = done
+
+            if verbose and (step + 1) % log_every == 0:
+                summary = meter.summary()
+                train_bar.set_postfix({"Train Loss": summary["Loss"], "Train RMSE": summary["RMSE"],
+                                       "Train MAPE": summary["MAPE"], "samples/s": summary["samples/s"]})
+        train_metrics = meter.summary()
+
+        # Validation phase
+        val_metrics = evaluate(model, val_loader, device=device, bf16=bf16,
+                               desc=f"Validation Epoch {epoch+1}/{epochs}", verbose=verbose)
+        if verbose:
+            print(f"Epoch {epoch+1}: "
+                  f"Train RMSE {train_metrics['RMSE']:.2f}, MAPE {train_metrics['MAPE']:.4f}, "
+                  f"{train_metrics['samples/s']:.1f} samples/s "
+                  f"(data {train_metrics['data s']:.1f}s, compute {train_metrics['compute s']:.1f}s) | "
+                  f"Val RMSE {val_metrics['RMSE']:.2f}, MAPE {val_metrics['MAPE']:.4f}")
+        history.append({"epoch": epoch, "train": train_metrics, "val": val_metrics})
+
+        if checkpoint_path and main_process:
+            save_checkpoint(checkpoint_path, model, optimizer, epoch, config)
+    return history
+
+
+def add_engine_args(parser):
+    """
+    Register the data loading and training options of the engine.
+    """
+    parser.add_argument("--data", default="../data/token_traj_chengdu_4d.tokens", help="traj_token.py --format npy output")
+    parser.add_argument("--model", choices=["lstm", "forward_lstm", "transformer"], default="lstm")
+    parser.add_argument("--max-rows", type=int, default=None)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches prefetched per worker")
+    parser.add_argument("--pin-memory", action="store_true")
+    parser.add_argument("--lengths", action="store_true",
+                        help="feed true lengths (packed LSTM / masked Transformer) with length-bucketed batches")
+    parser.add_argument("--prefixes", type=float, default=0.0,
+                        help="share of training trajectories cut to a random prefix (with --lengths, for forward_lstm)")
+    parser.add_argument("--bf16", action="store_true", help="bfloat16 autocast")
+    parser.add_argument("--accumulate", type=int, default=1, help="gradient accumulation steps")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file, written after every epoch")
+    parser.add_argument("--resume", action="store_true", help="resume from --checkpoint")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = add_engine_args(argparse.ArgumentParser(description="Train and test an ETA model"))
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    dataset = TrajectoryDataset(args.data, max_rows=args.max_rows, return_lengths=args.lengths)
+    train_set, val_set, test_set = split_dataset(dataset, seed=args.seed)
+    loader_options = {"batch_size": args.batch_size, "num_workers": args.workers, "prefetch_factor": args.prefetch,
+                      "pin_memory": args.pin_memory, "bucket": args.lengths,
+                      "collate_fn": trim_collate if args.lengths else None}
+    train_options = dict(loader_options)
+    if args.prefixes > 0:
+        if not args.lengths:
+            parser.error("--prefixes requires --lengths")
+        train_options["collate_fn"] = PrefixCollate(args.prefixes)
+    train_loader = make_loader(train_set, shuffle=True, **train_options)
+    val_loader = make_loader(val_set, **loader_options)
+    test_loader = make_loader(test_set, **loader_options)
+
+    input_dim = dataset.meta["input_dim"] + 1
+    config = {"model": args.model, "input_dim": input_dim}
+    model = build_model(args.model, input_dim)
+    train_model(model, train_loader, val_loader, epochs=args.epochs, lr=args.lr, device=device, bf16=args.bf16,
+                accumulation_steps=args.accumulate, checkpoint_path=args.checkpoint, resume=args.resume, config=config)
+    test_model(model, test_loader, device=device, bf16=args.bf16)
@@ -0,0 +1,242 @@
+# Export the ETA models to TorchScript and ONNX, check them against eager PyTorch and benchmark them on CPU
+#
+# Usage: python export.py --checkpoint ../data/lstm.pt --output-dir ../data/export --batch-sizes 1 8 32 128
+#   writes <output-dir>/<model>.ts.pt and <output-dir>/<model>.onnx, both taking (x, lengths)
+#   with dynamic batch and sequence axes, and returning eta of shape (batch,).
+#   A file is only written if it matches eager PyTorch on batches of other shapes.
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+
+from serve import load_model
+
+# 导出的模型在不支持的输入上运行失败时抛出的异常 (TorchScript 解释器, 量化算子, 输出形状不符)
+RUNTIME_ERRORS = (RuntimeError, ValueError, torch.jit.Error)
+
+try:
+    import onnxruntime
+    from onnxruntime.capi.onnxruntime_pybind11_state import Fail, InvalidArgument, RuntimeException
+
+    RUNTIME_ERRORS += (Fail, InvalidArgument, RuntimeException)
+except ImportError:  # ONNX Runtime 是可选依赖, 没有时只导出不运行
+    onnxruntime = None
+
+
+def example_batch(input_dim, batch_size=4, seq_length=32, seed=0):
+    """
+    Random padded batch with varied true lengths (the first trajectory fills the batch).
+
+    Returns:
+        tuple: x (batch_size, seq_length, input_dim) float32, lengths (batch_size,) int64.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(batch_size, seq_length, input_dim, generator=generator)
+    lengths = torch.randint(2, seq_length + 1, (batch_size,), generator=generator)
+    lengths[0] = seq_length
+    x[torch.arange(seq_length)[None, :] >= lengths[:, None]] = 0
+    return x, lengths
+
+
+def export_torchscript(model, path, example):
+    """
+    Save the model as TorchScript. Scripting keeps the data-dependent paths (packed
+    sequences, padding masks) for any shape; tracing is only the fallback.
+    """
+    try:
+        scripted = torch.jit.script(model)
+    except (RuntimeError, torch.jit.frontend.FrontendError) as error:
+        print(f"torch.jit.script failed ({type(error).__name__}), tracing instead")
+        scripted = torch.jit.trace(model, example)
+    torch.jit.save(scripted, path)
+    return path
+
+
+def export_onnx(model, path, example, opset_version=18):
+    """
+    Save the model as ONNX with dynamic batch and sequence axes.
+
+    The torch.export based exporter is tried first: the legacy exporter bakes the
+    example's sequence length into the Transformer's attention reshapes. The LSTM's
+    packed sequence is not supported by torch.export, so it goes through the legacy one.
+    """
+    options = {
+        "input_names": ["x", "lengths"],
+        "output_names": ["eta"],
+        "dynamic_axes": {"x": {0: "batch", 1: "seq"}, "lengths": {0: "batch"}, "eta": {0: "batch"}},
+        "opset_version": opset_version,
+    }
+    try:
+        torch.onnx.export(model, example, path, dynamo=True, **options)
+    except torch.onnx.OnnxExporterError as error:
+        print(f"torch.export based ONNX export failed ({type(error).__name__}), using the legacy exporter")
+        torch.onnx.export(model, example, path, dynamo=False, **options)
+    return path
+
+
+def load_runtime(path, threads=None):
+    """
+    Load an exported model for CPU inference.
+
+    Args:
+        path (str): .onnx file (run with ONNX Runtime) or TorchScript file.
+        threads (int): Intra-op threads of the ONNX Runtime session.
+
+    Returns:
+        callable: predict(x, lengths) taking tensors and returning a numpy array of ETAs.
+    """
+    if path.endswith(".onnx"):
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is required to run ONNX models: pip install onnxruntime")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        def predict(x, lengths):
+            return session.run(None, {"x": x.numpy(), "lengths": lengths.numpy()})[0]
+        return predict
+
+    module = torch.jit.load(path, map_location="cpu").eval()
+
+    def predict(x, lengths):
+        with torch.no_grad():
+            return module(x, lengths).numpy()
+    return predict
+
+
+def publish(staging_dir, path):
+    """
+    Move an export from the staging folder to path, together with the files saved
+    alongside it (the <name>.onnx.data external weights of the torch.export exporter).
+    """
+    filename = os.path.basename(path)
+    for staged in os.listdir(staging_dir):
+        if staged == filename or staged.startswith(filename + "."):
+            os.replace(os.path.join(staging_dir, staged), os.path.join(os.path.dirname(path), staged))
+
+
+def eager_runtime(model):
+    def predict(x, lengths):
+        with torch.no_grad():
+            return model(x, lengths).numpy()
+    return predict
+
+
+def check_equivalence(model, runtimes, input_dim, shapes=((1, 7), (5, 33), (16, 120)), atol=1e-4):
+    """
+    Compare every runtime with eager PyTorch on batches whose shapes differ from the
+    export example, so that a shape baked into the graph shows up as a mismatch.
+
+    Returns:
+        dict: Largest absolute difference per runtime (inf if it failed to run).
+    """
+    reference = eager_runtime(model)
+    errors = {}
+    for name, predict in runtimes.items():
+        worst = 0.0
+        for k, (batch_size, seq_length) in enumerate(shapes):
+            x, lengths = example_batch(input_dim, batch_size, seq_length, seed=k + 1)
+            try:
+                worst = max(worst, float(np.abs(predict(x, lengths) - reference(x, lengths)).max()))
+            except RUNTIME_ERRORS as error:
+                print(f"{name}: failed on batch {batch_size} x {seq_length}: {str(error)[:200]}")
+                worst = float("inf")
+                break
+        errors[name] = worst
+        print(f"{name}: max |diff| vs eager = {worst:.3g} ({'OK' if worst <= atol else 'MISMATCH'})")
+    return errors
+
+
+def benchmark(runtimes, input_dim, batch_sizes=(1, 8, 32, 128), seq_length=256, repeats=20, warmup=3):
+    """
+    Median latency in milliseconds of every runtime at every batch size.
+
+    Returns:
+        dict: {runtime: {batch_size: ms}}.
+    """
+    results = {name: {} for name in runtimes}
+    for batch_size in batch_sizes:
+        x, lengths = example_batch(input_dim, batch_size, seq_length)
+        for name, predict in runtimes.items():
+            for _ in range(warmup):
+                predict(x, lengths)
+            times = []
+            for _ in range(repeats):
+                tic = time.perf_counter()
+                predict(x, lengths)
+                times.append(time.perf_counter() - tic)
+            results[name][batch_size] = float(np.median(times)) * 1000
+    return results
+
+
+def print_table(results, batch_sizes):
+    print(f"{'runtime':<14}" + "".join(f"{f'batch {b} ms':>16}" for b in batch_sizes))
+    for name, row in results.items():
+        print(f"{name:<14}" + "".join(f"{row[b]:>16.2f}" for b in batch_sizes))
+    print(f"{'':<14}" + "".join(f"{'(traj/s)':>16}" for _ in batch_sizes))
+    for name, row in results.items():
+        print(f"{name:<14}" + "".join(f"{b / row[b] * 1000:>16.0f}" for b in batch_sizes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export an ETA model to TorchScript / ONNX and benchmark it on CPU")
+    parser.add_argument("--checkpoint", default=None, help="engine.py checkpoint, random weights if omitted")
+    parser.add_argument("--model", choices=["lstm", "forward_lstm", "transformer"], default="lstm", help="model without checkpoint")
+    parser.add_argument("--input-dim", type=int, default=5, help="token size (features + 1) without checkpoint")
+    parser.add_argument("--output-dir", default="../data/export")
+    parser.add_argument("--atol", type=float, default=1e-4, help="tolerance of the equivalence check")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--seq-length", type=int, default=256, help="padded length of the benchmark batches")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--no-benchmark", action="store_true")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads of every runtime")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, input_dim, config = load_model(args.checkpoint, args.model, args.input_dim)
+    name = config["model"] + (".int8" if config.get("quantized") else "")
+    os.makedirs(args.output_dir, exist_ok=True)
+    example = example_batch(input_dim)
+
+    # 先导出到临时目录 (文件名与目标相同, ONNX 外部权重文件的引用保持有效),
+    # 通过等价性检查后才移动到输出目录, 检查失败的导出不会留在磁盘上
+    staging_dir = os.path.join(args.output_dir, f".staging.{os.getpid()}")
+    os.makedirs(staging_dir)
+    runtimes = {"eager": eager_runtime(model)}
+    exported = {"torchscript": os.path.join(args.output_dir, f"{name}.ts.pt")}
+    if config.get("quantized"):
+        # 动态量化的打包权重无法导出为 ONNX, 量化模型只导出 TorchScript
+        print("Dynamically quantized models cannot be exported to ONNX, skipping the ONNX export")
+    else:
+        exported["onnxruntime"] = os.path.join(args.output_dir, f"{name}.onnx")
+    try:
+        staged = {runtime: os.path.join(staging_dir, os.path.basename(path)) for runtime, path in exported.items()}
+        export_torchscript(model, staged["torchscript"], example)
+        runtimes["torchscript"] = load_runtime(staged["torchscript"])
+        if "onnxruntime" in exported:
+            export_onnx(model, staged["onnxruntime"], example)
+            if onnxruntime is not None:
+                runtimes["onnxruntime"] = load_runtime(staged["onnxruntime"], threads=args.threads)
+            else:
+                print("onnxruntime is not installed, skipping the ONNX checks")
+
+        errors = check_equivalence(model, {k: v for k, v in runtimes.items() if k != "eager"}, input_dim, atol=args.atol)
+        for runtime, path in exported.items():
+            if errors.get(runtime, 0.0) <= args.atol:
+                publish(staging_dir, path)
+                print(f"Exported {path}")
+            else:
+                print(f"Not writing {path}: it does not match eager PyTorch")
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if not args.no_benchmark:
+        usable = {k: v for k, v in runtimes.items() if errors.get(k, 0.0) <= args.atol}
+        print_table(benchmark(usable, input_dim, args.batch_sizes, args.seq_length, args.repeats), args.batch_sizes)
+    if any(error > args.atol for error in errors.values()):
+        raise SystemExit("Exported model does not match eager PyTorch")
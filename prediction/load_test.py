@@ -0,0 +1,115 @@
+# Load generator for serve.py, runs entirely on localhost
+#
+# Usage: python load_test.py --port 8000 --concurrency 64 --requests 5000
+#        python load_test.py --self-test          # starts a server with random weights in-process
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+
+async def http_request(reader, writer, method, path, payload=None):
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = (await reader.readline()).decode()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        key, value = line.decode().split(":", 1)
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    response = json.loads(await reader.readexactly(length))
+    if not status.split(" ")[1].startswith("2"):
+        raise RuntimeError(f"{status.strip()}: {response}")
+    return response
+
+
+def random_trajectory(rng, n_features, mean_length):
+    """
+    Synthetic trip around Chengdu: a random walk in lng/lat, the other features uniform.
+    """
+    length = max(2, int(rng.exponential(mean_length)))
+    points = rng.random((length, n_features))
+    points[:, 0] = 104.06 + np.cumsum(rng.normal(0, 1e-3, length))
+    points[:, 1] = 30.66 + np.cumsum(rng.normal(0, 1e-3, length))
+    return points.tolist()
+
+
+async def client(host, port, jobs, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while jobs:
+            trajectory = jobs.pop()
+            tic = time.perf_counter()
+            await http_request(reader, writer, "POST", "/predict", {"trajectory": trajectory})
+            latencies.append(time.perf_counter() - tic)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run_load(host, port, n_requests, concurrency, n_features, mean_length, seed=0):
+    """
+    Send n_requests trajectories over `concurrency` keep-alive connections.
+
+    Returns:
+        dict: Client-side latency percentiles and throughput, plus the server metrics.
+    """
+    rng = np.random.default_rng(seed)
+    jobs = [random_trajectory(rng, n_features, mean_length) for _ in range(n_requests)]
+    latencies = []
+    tic = time.perf_counter()
+    await asyncio.gather(*[client(host, port, jobs, latencies) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - tic
+
+    reader, writer = await asyncio.open_connection(host, port)
+    server_metrics = await http_request(reader, writer, "GET", "/metrics")
+    writer.close()
+    await writer.wait_closed()
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "server": server_metrics,
+    }
+
+
+async def main(args):
+    if args.self_test:
+        from serve import load_model, start_server
+        model, input_dim, _ = load_model(None, args.model, args.n_features + 1)
+        server, _, batch_task = await start_server(model, input_dim, args.host, args.port, args.max_batch, args.max_wait_ms)
+    report = await run_load(args.host, args.port, args.requests, args.concurrency, args.n_features, args.mean_length)
+    print(f"client: {report['requests']} requests, {report['throughput']:.1f} req/s, "
+          f"p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+    print("server:", json.dumps(report["server"]))
+    if args.self_test:
+        # 等服务端处理完客户端断开后再关闭
+        await asyncio.sleep(0.1)
+        server.close()
+        await server.wait_closed()
+        batch_task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the ETA inference server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--n-features", type=int, default=4, help="features per point")
+    parser.add_argument("--mean-length", type=float, default=200, help="mean number of points per trip")
+    parser.add_argument("--self-test", action="store_true", help="start a random-weight server in this process")
+    parser.add_argument("--model", choices=["lstm", "forward_lstm", "transformer"], default="lstm", help="model for --self-test")
+    parser.add_argument("--max-batch", type=int, default=64, help="server batch size for --self-test")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="server latency budget for --self-test")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,163 @@
+# ETA models for the tokenized trajectories
+import torch
+from torch import nn
+
+
+# Define the bi-LSTM model
+class BiLSTMTimePredictor(nn.Module):
+    def __init__(self, input_dim=3, hidden_dim=128, num_layers=2):
+        super().__init__()
+        self.encoder = nn.LSTM(
+            input_dim, hidden_dim, num_layers=num_layers, batch_first=True, bidirectional=True
+        )
+        self.classifier = nn.Linear(hidden_dim * 2 * num_layers, 1)  # *2 because bidirectional
+
+    def forward(self, x, lengths: torch.Tensor | None = None):  # annotated for torch.jit.script
+        """
+        Args:
+            x (torch.Tensor): (batch_size, seq_length, input_dim) padded trajectories.
+            lengths (torch.Tensor): Optional true length of every trajectory. When given, the
+                LSTM runs over a packed sequence and skips the padding steps entirely; the
+                final hidden states are then taken at each trajectory's own last step.
+        """
+        if lengths is not None:
+            x = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        _, (hidden, _) = self.encoder(x)  # hidden shape: (num_layers*2, batch_size, hidden_dim)
+        hidden = hidden.permute(1, 0, 2).reshape(hidden.size(1), -1)  # Flatten hidden states
+        return self.classifier(hidden).squeeze(-1)
+
+
+class ForwardLSTMTimePredictor(nn.Module):
+    """
+    Unidirectional LSTM whose prediction only depends on the recurrent state after
+    the last token, so a live trip can be extended one point at a time with `step`
+    instead of re-running the prefix (see streaming.py).
+
+    Args:
+        input_dim (int): Token size (features + index).
+        hidden_dim (int): LSTM hidden size.
+        num_layers (int): Number of stacked LSTM layers.
+    """
+    def __init__(self, input_dim=3, hidden_dim=128, num_layers=2):
+        super().__init__()
+        self.encoder = nn.LSTM(input_dim, hidden_dim, num_layers=num_layers, batch_first=True)
+        self.classifier = nn.Linear(hidden_dim * num_layers, 1)
+
+    def head(self, hidden):
+        # hidden: (num_layers, batch_size, hidden_dim) -> ETA of every trip
+        return self.classifier(hidden.permute(1, 0, 2).reshape(hidden.size(1), -1)).squeeze(-1)
+
+    def forward(self, x, lengths: torch.Tensor | None = None):  # annotated for torch.jit.script
+        """
+        Args:
+            x (torch.Tensor): (batch_size, seq_length, input_dim) padded trajectories.
+            lengths (torch.Tensor): Optional true lengths, the LSTM then runs over a packed sequence.
+        """
+        if lengths is not None:
+            x = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        _, (hidden, _) = self.encoder(x)
+        return self.head(hidden)
+
+    def step(self, x, state: tuple[torch.Tensor, torch.Tensor] | None = None):
+        """
+        Advance a batch of trips by one token each.
+
+        Args:
+            x (torch.Tensor): (batch_size, input_dim) next token of every trip.
+            state (tuple): (h, c) of shape (num_layers, batch_size, hidden_dim), None at the start token.
+
+        Returns:
+            tuple: ETA of every trip (batch_size,) and the new (h, c).
+        """
+        _, state = self.encoder(x.unsqueeze(1), state)
+        return self.head(state[0]), state
+
+
+class TransformerTimePredictor(nn.Module):
+    def __init__(self, input_dim=3, hidden_dim=128, nhead=4, num_encoder_layers=4, mlp_hidden_dim=256):
+        """
+        Transformer-based model for time prediction.
+
+        Args:
+            input_dim (int): Number of features in each input step (e.g., 2 for [x, y]).
+            hidden_dim (int): Embedding dimension for the Transformer.
+            nhead (int): Number of attention heads in the Transformer.
+            num_encoder_layers (int): Number of Transformer encoder layers.
+            mlp_hidden_dim (int): Number of hidden units in the MLP classifier.
+        """
+        super().__init__()
+
+        # Input embedding layer
+        self.embedding = nn.Linear(input_dim, hidden_dim)
+
+        # Transformer encoder
+        self.encoder_layer = nn.TransformerEncoderLayer(
+            d_model=hidden_dim, nhead=nhead, dim_feedforward=hidden_dim * 4, batch_first=True
+        )
+        self.transformer_encoder = nn.TransformerEncoder(self.encoder_layer, num_layers=num_encoder_layers)
+
+        # MLP classifier
+        self.classifier = nn.Sequential(
+            nn.Linear(hidden_dim, mlp_hidden_dim),
+            nn.ReLU(),
+            nn.Linear(mlp_hidden_dim, mlp_hidden_dim // 2),
+            nn.ReLU(),
+            nn.Linear(mlp_hidden_dim // 2, 1),  # Output a single value
+        )
+
+    def forward(self, x, lengths: torch.Tensor | None = None):  # annotated for torch.jit.script
+        """
+        Args:
+            x (torch.Tensor): (batch_size, seq_length, input_dim) padded trajectories.
+            lengths (torch.Tensor): Optional true length of every trajectory. When given, the
+                padding steps are masked out of the attention, so they neither cost attention
+                weight nor leak into the first token's representation.
+        """
+        padding_mask: torch.Tensor | None = None
+        if lengths is not None:
+            positions = torch.arange(x.size(1), device=x.device)
+            padding_mask = positions[None, :] >= lengths.to(x.device)[:, None]  # True = padding
+
+        # Embed input
+        x = self.embedding(x)  # Shape: (batch_size, seq_length, hidden_dim)
+
+        # Transformer encoding
+        x = self.transformer_encoder(x, src_key_padding_mask=padding_mask)  # Shape: (batch_size, seq_length, hidden_dim)
+
+        # Use only the first token's representation for classification
+        x = x[:, 0, :]  # Shape: (batch_size, hidden_dim)
+
+        # Classifier
+        output = self.classifier(x)  # Shape: (batch_size, 1)
+        return output.squeeze(-1)
+
+
+def build_model(name, input_dim, **kwargs):
+    """
+    Create an ETA model by name ("lstm", "forward_lstm" or "transformer") with the notebook's default sizes.
+    """
+    if name == "lstm":
+        return BiLSTMTimePredictor(input_dim=input_dim, **{"num_layers": 2, **kwargs})
+    if name == "forward_lstm":
+        return ForwardLSTMTimePredictor(input_dim=input_dim, **{"num_layers": 2, **kwargs})
+    if name == "transformer":
+        defaults = {"hidden_dim": 128, "nhead": 4, "num_encoder_layers": 4, "mlp_hidden_dim": 256}
+        return TransformerTimePredictor(input_dim=input_dim, **{**defaults, **kwargs})
+    raise ValueError(f"Unknown model: {name}")
+
+
+def quantize_model(model, dtype=torch.qint8):
+    """
+    Dynamic int8 quantization for CPU inference: LSTM and Linear weights are stored
+    as int8 and activations are quantized on the fly, so no calibration data is needed.
+
+    Returns:
+        nn.Module: Quantized copy of the model, in eval mode.
+    """
+    quantized = torch.ao.quantization.quantize_dynamic(model.eval(), {nn.LSTM, nn.Linear}, dtype=dtype)
+    if isinstance(quantized, TransformerTimePredictor):
+        # PyTorch 的融合快速路径直接读取 linear1.weight 等张量, 与量化后的 Linear 不兼容, 关闭后逐层计算
+        quantized.transformer_encoder.use_nested_tensor = False
+        for layer in quantized.transformer_encoder.layers:
+            layer.activation_relu_or_gelu = 0
+    return quantized
@@ -0,0 +1,90 @@
+# Dynamic int8 quantization of a trained ETA model and its accuracy / speed / serialized size report against fp32
+#
+# Usage: python quantize.py --checkpoint ../data/lstm.pt --data ../data/token_traj_chengdu_4d.tokens --lengths
+#   writes ../data/lstm.int8.pt, which serve.py --checkpoint loads like any engine.py checkpoint
+import argparse
+import io
+import os
+
+import torch
+
+from dataset import TrajectoryDataset, trim_collate
+from engine import evaluate, make_loader, split_dataset
+from export import benchmark, eager_runtime, print_table
+from models import quantize_model
+from serve import load_model
+
+
+def save_quantized(path, model, config):
+    """
+    Save a quantized model with its engine.py config, marked so `serve.load_model`
+    quantizes the freshly built model before loading the int8 weights.
+    """
+    tmp_path = path + ".tmp"
+    torch.save({"model": model.state_dict(), "config": {**config, "quantized": "dynamic_int8"}}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def weights_size(model):
+    """
+    Serialized size of the model state_dict in bytes. This is the size on disk, not the
+    resident memory of the loaded model.
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def compare(fp32_metrics, int8_metrics):
+    """
+    Print the test metrics of both models side by side with the drift of the int8 one.
+    """
+    print(f"{'':<10}{'RMSE':>12}{'MAPE':>12}{'samples/s':>12}")
+    for name, metrics in (("fp32", fp32_metrics), ("int8", int8_metrics)):
+        print(f"{name:<10}{metrics['RMSE']:>12.2f}{metrics['MAPE']:>12.4f}{metrics['samples/s']:>12.1f}")
+    print(f"{'drift':<10}{int8_metrics['RMSE'] - fp32_metrics['RMSE']:>+12.2f}"
+          f"{int8_metrics['MAPE'] - fp32_metrics['MAPE']:>+12.4f}"
+          f"{int8_metrics['samples/s'] / fp32_metrics['samples/s']:>11.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize an ETA model to int8 and compare it with fp32")
+    parser.add_argument("--checkpoint", required=True, help="engine.py checkpoint")
+    parser.add_argument("--output", default=None, help="int8 model file, <checkpoint>.int8.pt by default")
+    parser.add_argument("--data", default="../data/token_traj_chengdu_4d.tokens", help="held-out split is taken from here")
+    parser.add_argument("--max-rows", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--lengths", action="store_true", help="feed true lengths, as engine.py --lengths")
+    parser.add_argument("--seed", type=int, default=0, help="split seed used for training")
+    parser.add_argument("--no-eval", action="store_true", help="only write the int8 model")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128], help="latency benchmark")
+    parser.add_argument("--seq-length", type=int, default=256, help="padded length of the benchmark batches")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    output = args.output or os.path.splitext(args.checkpoint)[0] + ".int8.pt"
+    model, input_dim, config = load_model(args.checkpoint)
+    if config.get("quantized"):
+        parser.error(f"{args.checkpoint} is already quantized")
+    quantized = quantize_model(model)
+    save_quantized(output, quantized, config)
+    print(f"Wrote {output}: serialized weights {weights_size(model) / 2**20:.2f} MB fp32 -> "
+          f"{weights_size(quantized) / 2**20:.2f} MB int8, "
+          f"file {os.path.getsize(args.checkpoint) / 2**20:.2f} MB -> {os.path.getsize(output) / 2**20:.2f} MB")
+
+    if not args.no_eval:
+        # 与 engine.py 相同的种子划分, 只在测试集上比较
+        dataset = TrajectoryDataset(args.data, max_rows=args.max_rows, return_lengths=args.lengths)
+        _, _, test_set = split_dataset(dataset, seed=args.seed)
+        test_loader = make_loader(test_set, batch_size=args.batch_size, num_workers=args.workers, bucket=args.lengths,
+                                  collate_fn=trim_collate if args.lengths else None)
+        fp32_metrics = evaluate(model, test_loader, desc="Testing fp32")
+        int8_metrics = evaluate(quantized, test_loader, desc="Testing int8")
+        compare(fp32_metrics, int8_metrics)
+
+    runtimes = {"fp32": eager_runtime(model), "int8": eager_runtime(quantized)}
+    print_table(benchmark(runtimes, input_dim, args.batch_sizes, args.seq_length, args.repeats), args.batch_sizes)
@@ -0,0 +1,18 @@
+# The ../utils modules used by the prediction scripts, importable whatever the working directory
+#
+# Usage: from repo_utils import file_fingerprint, pack_batch, run_days
+#
+# utils is a folder of scripts rather than a package, its modules import each other by bare name,
+# so the folder itself goes on sys.path. This is the only place the prediction code does that.
+import os
+import sys
+
+UTILS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+if UTILS_DIR not in sys.path:
+    sys.path.append(UTILS_DIR)
+
+from manifest import file_fingerprint
+from parallel_days import run_days
+from traj_token import pack_batch
+
+__all__ = ["file_fingerprint", "pack_batch", "run_days"]
@@ -0,0 +1,206 @@
+# Compact binary snapshot of the osmnx road network, for notebooks that start in well under a second
+#
+# Usage: python road_snapshot.py --graph ../data/chengdu_road_network.graphml   # build (or check) the snapshot
+#   roads = load_snapshot("../data/chengdu_road_network.graphml")  # in a notebook: built once, then memory-mapped
+#   nodes, edges = roads.nodes_frame(), roads.edges_frame()         # replaces ox.graph_to_gdfs(G), without geometries
+#   road_index = roads.index                                        # prebuilt RoadIndex
+#
+# The snapshot folder (next to the graphml by default) holds .npy arrays only: node ids and coordinates,
+# CSR adjacency, edge polylines as flat coordinates plus offsets, edge attributes and midpoints, and
+# the pieces and k-d tree of a RoadIndex. It records the fingerprint of the graphml it was built from
+# and is rebuilt automatically when that file changes.
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from repo_utils import file_fingerprint
+from road_index import RoadIndex, edge_arrays
+
+SNAPSHOT_VERSION = 1
+EDGE_ATTRIBUTES = ["osmid", "highway", "name", "oneway", "lanes", "maxspeed", "length"]
+
+
+def _midpoints(coords, offsets):
+    # 每条折线在经纬度平面上长度一半处的点, 与 geom.interpolate(0.5, normalized=True) 一致
+    n_edges = len(offsets) - 1
+    step = np.zeros(len(coords))
+    step[1:] = np.hypot(*(coords[1:] - coords[:-1]).T)
+    step[offsets[:-1]] = 0
+    distance = np.cumsum(step)
+    distance -= np.repeat(distance[offsets[:-1]], np.diff(offsets))
+    half = distance[offsets[1:] - 1] / 2
+
+    # 边内距离单调不减, 不超过一半长度的顶点数即中点所在线段的起点
+    edge_of_vertex = np.repeat(np.arange(n_edges), np.diff(offsets))
+    below = np.bincount(edge_of_vertex, weights=distance <= half[edge_of_vertex], minlength=n_edges)
+    lo = offsets[:-1] + below.astype(np.int64) - 1
+    hi = np.minimum(lo + 1, offsets[1:] - 1)
+    span = distance[hi] - distance[lo]
+    frac = np.where(span > 0, (half - distance[lo]) / np.where(span > 0, span, 1), 0.0)
+    return coords[lo] + np.clip(frac, 0, 1)[:, None] * (coords[hi] - coords[lo])
+
+
+def _attribute(values):
+    # 数值 / 布尔属性保持原类型, 其余 (包括 osmnx 合并路段得到的列表) 转为字符串, 缺失为空串
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, (bool, np.bool_)) for value in present):
+        return np.array([bool(value) for value in values])
+    if present and all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool) for value in present):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array(["" if value is None else str(value) for value in values])
+
+
+def build_snapshot(G, path, source=None, max_segment=50.0):
+    """
+    Write the snapshot of a road graph to a folder, replacing any previous one.
+
+    Args:
+        G (nx.MultiDiGraph): osmnx road graph.
+        path (str): Snapshot folder.
+        source (str): graphml file G was loaded from, fingerprinted for invalidation.
+        max_segment (float): Piece length of the RoadIndex.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+    node_xy = np.array([(data["x"], data["y"]) for _, data in G.nodes(data=True)], dtype=np.float64)
+    coords, offsets, ids = edge_arrays(G)
+
+    # CSR 邻接表: 节点 i 的出边为 adjacency[indptr[i]:indptr[i + 1]]
+    node_position = pd.Index(node_ids)
+    u = node_position.get_indexer(ids[:, 0])
+    v = node_position.get_indexer(ids[:, 1])
+    adjacency = np.argsort(u, kind="stable")
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=len(node_ids)), out=indptr[1:])
+
+    arrays = {"node_ids": node_ids, "node_xy": node_xy, "indptr": indptr, "adjacency": adjacency,
+              "edge_u": u.astype(np.int64), "edge_v": v.astype(np.int64), "midpoints": _midpoints(coords, offsets)}
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    attributes = [data for _, _, data in G.edges(data=True)]
+    for name in EDGE_ATTRIBUTES:
+        np.save(os.path.join(tmp_path, f"edge_{name}.npy"), _attribute([data.get(name) for data in attributes]))
+    RoadIndex(coords, offsets, ids, max_segment=max_segment).save(os.path.join(tmp_path, "index"))
+
+    meta = {"version": SNAPSHOT_VERSION, "source": None if source is None else file_fingerprint(source),
+            "max_segment": max_segment, "n_nodes": len(node_ids), "n_edges": len(ids),
+            "edge_attributes": EDGE_ATTRIBUTES}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    # 写完整个目录后再替换, 中断时不会留下不完整的快照
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def is_fresh(path, source, max_segment=50.0):
+    """
+    True if the snapshot exists and was built from the current content of source.
+    """
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get("version") != SNAPSHOT_VERSION or meta.get("max_segment") != max_segment or meta["source"] is None:
+        return False
+    current = file_fingerprint(source)
+    return all(current[key] == meta["source"][key] for key in ("path", "size", "mtime_ns"))
+
+
+class RoadSnapshot:
+    """
+    Memory-mapped road network written by `build_snapshot`.
+
+    Attributes:
+        node_ids, node_xy: osmid and lng/lat of every node.
+        indptr, adjacency: CSR adjacency, the edges leaving node i are adjacency[indptr[i]:indptr[i + 1]].
+        edge_u, edge_v: Node positions of the ends of every edge.
+        midpoints: lng/lat of the middle of every edge polyline.
+        attributes: Edge attribute arrays by name (see EDGE_ATTRIBUTES).
+        index: The prebuilt RoadIndex, holding the polylines (coords, offsets) and the (u, v, key) ids.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        for name in ["node_ids", "node_xy", "indptr", "adjacency", "edge_u", "edge_v", "midpoints"]:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.attributes = {name: np.load(os.path.join(path, f"edge_{name}.npy"), mmap_mode="r")
+                           for name in self.meta["edge_attributes"]}
+        self.index = RoadIndex.load(os.path.join(path, "index"))
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_u)
+
+    def out_edges(self, node):
+        """
+        Edge indices leaving the node at position `node`.
+        """
+        return self.adjacency[self.indptr[node]:self.indptr[node + 1]]
+
+    def nodes_frame(self):
+        """
+        Nodes as a DataFrame indexed by osmid with x / y columns, like ox.graph_to_gdfs(G)[0].
+        """
+        return pd.DataFrame({"x": self.node_xy[:, 0], "y": self.node_xy[:, 1]},
+                            index=pd.Index(self.node_ids, name="osmid"))
+
+    def edges_frame(self):
+        """
+        Edges as a DataFrame indexed by (u, v, key) like ox.graph_to_gdfs(G)[1], with the
+        attributes and the midpoint (mid_x, mid_y) instead of a geometry column.
+        """
+        frame = pd.DataFrame(dict(self.attributes), index=self.index.edge_ids()[:-1])
+        frame["mid_x"] = self.midpoints[:, 0]
+        frame["mid_y"] = self.midpoints[:, 1]
+        return frame
+
+
+def load_snapshot(graphml_path, path=None, max_segment=50.0, rebuild=False):
+    """
+    Snapshot of a graphml road network, (re)built first if missing or out of date.
+
+    Args:
+        graphml_path (str): osmnx graphml file.
+        path (str): Snapshot folder, `<graphml_path>.snapshot` by default.
+        max_segment (float): Piece length of the RoadIndex.
+        rebuild (bool): Rebuild even if the snapshot is fresh.
+
+    Returns:
+        RoadSnapshot
+    """
+    path = path or f"{graphml_path}.snapshot"
+    if rebuild or not is_fresh(path, graphml_path, max_segment):
+        import osmnx as ox
+
+        print(f"Building road snapshot {path} from {graphml_path}...")
+        build_snapshot(ox.load_graphml(graphml_path), path, source=graphml_path, max_segment=max_segment)
+    return RoadSnapshot(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped snapshot of a graphml road network")
+    parser.add_argument("--graph", default="../data/chengdu_road_network.graphml")
+    parser.add_argument("--output", default=None, help="snapshot folder, <graph>.snapshot by default")
+    parser.add_argument("--max-segment", type=float, default=50.0, help="RoadIndex piece length in metres")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild even if the snapshot is up to date")
+    args = parser.parse_args()
+
+    load_snapshot(args.graph, args.output, args.max_segment, args.rebuild)
+    tic = time.perf_counter()
+    roads = load_snapshot(args.graph, args.output, args.max_segment)
+    edges = roads.edges_frame()
+    print(f"{roads.n_nodes} nodes, {len(edges)} edges, loaded in {time.perf_counter() - tic:.3f}s")
@@ -0,0 +1,237 @@
+# Local ETA inference server with micro-batching
+#
+# Usage: python serve.py --checkpoint ../data/lstm.pt --port 8000 --max-batch 64 --max-wait-ms 5
+#   POST /predict  {"trajectory": [[lng, lat, ...], ...]}  ->  {"eta": seconds}
+#   GET  /metrics  latency percentiles, throughput and batch sizes
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from models import build_model, quantize_model
+from repo_utils import pack_batch
+
+
+def load_model(checkpoint_path=None, model_name="lstm", input_dim=5):
+    """
+    Model from an engine.py checkpoint (or its int8 version written by quantize.py),
+    or a randomly initialised one for load testing.
+
+    Returns:
+        tuple: (model in eval mode, token size input_dim, config dict of the checkpoint
+            with at least "model" and "input_dim").
+    """
+    if checkpoint_path is None:
+        model = build_model(model_name, input_dim)
+        config = {"model": model_name, "input_dim": input_dim}
+    else:
+        # 量化模型的打包权重不是普通张量, weights_only 无法加载
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        config = checkpoint["config"]
+        input_dim = config["input_dim"]
+        model = build_model(config["model"], input_dim)
+        if config.get("quantized"):
+            model = quantize_model(model)
+        model.load_state_dict(checkpoint["model"])
+    return model.eval(), input_dim, config
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches: a batch is run as soon as it holds
+    `max_batch` trajectories or the oldest request has waited `max_wait_ms`.
+
+    Args:
+        model (nn.Module): ETA model taking (x, lengths).
+        n_features (int): Features per trajectory point (token size minus the index).
+        max_batch (int): Largest batch passed to the model.
+        max_wait_ms (float): Latency budget spent waiting for more requests.
+        window (int): Latest requests and batches the metrics are computed over.
+    """
+    def __init__(self, model, n_features, max_batch=64, max_wait_ms=5.0, window=100000):
+        self.model = model
+        self.n_features = n_features
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        # 模型在单独线程里运行, 事件循环继续接收请求
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # 只保留最近 window 个请求 / 批次, 长时间运行的服务内存不增长
+        self.latencies = deque(maxlen=window)
+        self.finished = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+
+    async def predict(self, trajectory):
+        trajectory = np.asarray(trajectory, dtype=np.float64)
+        # 在入队前检查, 一个错误请求不会让整批失败
+        if trajectory.ndim != 2 or len(trajectory) == 0 or trajectory.shape[1] != self.n_features:
+            raise ValueError(f"trajectory must be a non-empty list of {self.n_features}-feature points")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((trajectory, future))
+        return await future
+
+    def _run(self, trajectories):
+        lengths = np.array([len(t) for t in trajectories])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        tokens, token_offsets = pack_batch(np.concatenate(trajectories), offsets)
+        xs = [torch.from_numpy(tokens[token_offsets[k]:token_offsets[k + 1]]) for k in range(len(trajectories))]
+        x = torch.nn.utils.rnn.pad_sequence(xs, batch_first=True)
+        with torch.no_grad():
+            return self.model(x, torch.from_numpy(lengths + 2)).tolist()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except TimeoutError:
+                    break
+            trajectories, futures = zip(*batch)
+            try:
+                etas = await loop.run_in_executor(self.executor, self._run, list(trajectories))
+            except (RuntimeError, ValueError) as error:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batch_sizes.append(len(batch))
+            self.batches += 1
+            for future, eta in zip(futures, etas):
+                if not future.done():
+                    future.set_result(eta)
+
+    def record(self, latency):
+        """
+        Record a served request and its latency in seconds.
+        """
+        self.latencies.append(latency)
+        self.finished.append(time.perf_counter())
+        self.requests += 1
+
+    def metrics(self):
+        """
+        Lifetime request and batch counts, and latency percentiles, throughput and mean
+        batch size over the latest `window` requests.
+        """
+        if not self.latencies:
+            return {"requests": 0}
+        latencies = np.array(self.latencies) * 1000
+        # 吞吐量按窗口内第一个到最后一个完成的请求计算, 不含服务空闲时间
+        span = self.finished[-1] - self.finished[0]
+        return {
+            "requests": self.requests,
+            "window": len(latencies),
+            "throughput": (len(self.finished) - 1) / span if span > 0 else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "mean_batch": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "batches": self.batches,
+        }
+
+
+def _response(status, payload):
+    body = json.dumps(payload).encode()
+    head = f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode() + body
+
+
+async def handle_connection(batcher, reader, writer):
+    """
+    Minimal HTTP/1.1 handler with keep-alive: POST /predict and GET /metrics.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise ValueError(f"invalid Content-Length {length}")
+            except ValueError as error:
+                # 请求行 / 请求头无法解析 (包括非 UTF-8 字节), 后续数据无法分帧, 回复 400 后关闭连接
+                writer.write(_response("400 Bad Request", {"error": f"malformed request: {error}"}))
+                await writer.drain()
+                break
+            body = await reader.readexactly(length)
+
+            received = time.perf_counter()
+            if method == "POST" and path == "/predict":
+                try:
+                    trajectory = json.loads(body)["trajectory"]
+                    eta = await batcher.predict(trajectory)
+                    batcher.record(time.perf_counter() - received)
+                    writer.write(_response("200 OK", {"eta": eta}))
+                except (KeyError, ValueError, TypeError) as error:
+                    writer.write(_response("400 Bad Request", {"error": str(error)}))
+                except RuntimeError as error:
+                    writer.write(_response("500 Internal Server Error", {"error": str(error)}))
+            elif method == "GET" and path == "/metrics":
+                writer.write(_response("200 OK", batcher.metrics()))
+            else:
+                writer.write(_response("404 Not Found", {"error": path}))
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(model, input_dim, host="127.0.0.1", port=8000, max_batch=64, max_wait_ms=5.0):
+    """
+    Start the batcher and the HTTP server, returning (server, batcher, batch_task).
+    """
+    batcher = MicroBatcher(model, input_dim - 1, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    batch_task = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(lambda r, w: handle_connection(batcher, r, w), host, port)
+    return server, batcher, batch_task
+
+
+async def main(args):
+    model, input_dim, _ = load_model(args.checkpoint, args.model, args.input_dim)
+    server, _, _ = await start_server(model, input_dim, args.host, args.port, args.max_batch, args.max_wait_ms)
+    print(f"Serving on http://{args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+def add_server_args(parser):
+    parser.add_argument("--checkpoint", default=None, help="engine.py checkpoint, random weights if omitted")
+    parser.add_argument("--model", choices=["lstm", "forward_lstm", "transformer"], default="lstm", help="model without checkpoint")
+    parser.add_argument("--input-dim", type=int, default=5, help="token size (features + 1) without checkpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="latency budget for filling a batch")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    return parser
+
+
+if __name__ == "__main__":
+    args = add_server_args(argparse.ArgumentParser(description="ETA inference server")).parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    asyncio.run(main(args))
@@ -0,0 +1,9 @@
+# The scripts in utils/ and prediction/ import their neighbours by bare module name, so the tests do too
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("utils", "prediction"):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
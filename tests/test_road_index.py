@@ -0,0 +1,72 @@
+# RoadIndex.query against a brute-force scan of every road segment
+import numpy as np
+
+from road_index import RoadIndex, project
+
+
+def random_network(n_edges=300, seed=0):
+    # 随机折线路网, 约 6 km 见方, 每条边 2-6 个顶点
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 7, n_edges)
+    offsets = np.zeros(n_edges + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    start = rng.uniform([104.03, 30.64], [104.09, 30.70], (n_edges, 2))
+    steps = rng.normal(scale=0.002, size=(offsets[-1], 2))
+    steps[offsets[:-1]] = 0
+    coords = np.repeat(start, lengths, axis=0) + np.cumsum(steps, axis=0) - np.repeat(
+        np.cumsum(steps, axis=0)[offsets[:-1]], lengths, axis=0)
+    ids = np.column_stack([np.arange(n_edges), np.arange(n_edges) + 1, np.zeros(n_edges, dtype=np.int64)])
+    return coords, offsets, ids
+
+
+def brute_force(index, lng, lat):
+    # 每个点到每条边每条线段的精确距离, 返回每个点每条边的最短距离 (n_points, n_edges)
+    xy = project(lng, lat, index.origin)
+    vertices = project(index.coords[:, 0], index.coords[:, 1], index.origin)
+    best = np.full((len(xy), index.n_edges), np.inf)
+    for e in range(index.n_edges):
+        line = vertices[index.offsets[e]:index.offsets[e + 1]]
+        a, b = line[:-1], line[1:]
+        ab = b - a
+        t = np.clip(np.einsum("pij,ij->pi", xy[:, None] - a, ab) / np.einsum("ij,ij->i", ab, ab), 0, 1)
+        distance = np.hypot(*np.moveaxis(a + t[..., None] * ab - xy[:, None], -1, 0))
+        best[:, e] = distance.min(axis=1)
+    return best
+
+
+def random_points(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(104.02, 104.10, n), rng.uniform(30.63, 30.71, n)
+
+
+def test_query_matches_brute_force():
+    index = RoadIndex(*random_network())
+    lng, lat = random_points(2000)
+    edge, distance, offset = index.query(lng, lat)
+    best = brute_force(index, lng, lat)
+    np.testing.assert_allclose(distance, best.min(axis=1), rtol=1e-9, atol=1e-6)
+    # 并列最近 (共享顶点) 时任一条都可以, 检查返回边的距离就是最短距离
+    np.testing.assert_allclose(best[np.arange(len(lng)), edge], distance, rtol=1e-9, atol=1e-6)
+    assert ((offset >= -1e-6) & (offset <= index.edge_length[edge] + 1e-6)).all()
+
+
+def test_query_max_distance_and_workers():
+    index = RoadIndex(*random_network(seed=2), max_segment=20.0)
+    lng, lat = random_points(1500, seed=3)
+    best = brute_force(index, lng, lat).min(axis=1)
+    edge, distance, offset = index.query(lng, lat, max_distance=40.0, k=2, workers=3, chunk_size=100)
+    near = best <= 40.0
+    assert near.any() and (~near).any()
+    np.testing.assert_allclose(distance[near], best[near], rtol=1e-9, atol=1e-6)
+    assert (edge[~near] == -1).all() and np.isinf(distance[~near]).all() and np.isnan(offset[~near]).all()
+
+
+def test_saved_index_gives_same_answers(tmp_path):
+    index = RoadIndex(*random_network(seed=4))
+    lng, lat = random_points(500, seed=5)
+    expected = index.query(lng, lat, max_distance=100.0)
+    for pieces in (True, False):
+        index.save(tmp_path / f"index-{pieces}", pieces=pieces)
+        loaded = RoadIndex.load(tmp_path / f"index-{pieces}")
+        for got, want in zip(loaded.query(lng, lat, max_distance=100.0), expected):
+            np.testing.assert_array_equal(got, want)
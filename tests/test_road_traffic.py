@@ -0,0 +1,74 @@
+# hourly_traffic / point_traffic against the groupby code of the original traffic_flow notebook
+import numpy as np
+import pandas as pd
+
+from road_traffic import hourly_traffic, point_traffic
+
+
+def notebook_traffic(gdf, edges_index, n_days):
+    # 原 notebook 第 8-10 格: 每辆车每小时按时间排序, 道路变化时计一次, 再按小时累加
+    def calculate_hourly_unique_traffic(group):
+        unique_traffic = []
+        for hour, hourly_group in group.groupby("Hour"):
+            hourly_group = hourly_group.sort_values("Time")
+            hourly_group["road_change"] = hourly_group["matched_road"].shift() != hourly_group["matched_road"]
+            unique_traffic.append(hourly_group[hourly_group["road_change"]])
+        return pd.concat(unique_traffic)
+
+    unique_traffic_df = gdf.groupby("VehicleNum").apply(calculate_hourly_unique_traffic).reset_index(drop=True)
+    traffic_counts = {road: [0] * 24 for road in edges_index}
+    for hour, group in unique_traffic_df.groupby("Hour"):
+        road_counts = group["matched_road"].value_counts()
+        for road_id, count in road_counts.items():
+            traffic_counts[road_id][hour] += count / n_days
+
+    def get_hourly_traffic(row):
+        return traffic_counts.get(row["matched_road"], [0] * 24)[row["Hour"]]
+
+    return traffic_counts, gdf.apply(get_hourly_traffic, axis=1).to_numpy()
+
+
+def random_points(n_vehicles=15, n_points=4000, n_edges=40, n_days=3, seed=0):
+    # 几天内的轨迹点, 行顺序打乱; 每辆车的时间互不相同, 道路按连续段出现以产生重复
+    rng = np.random.default_rng(seed)
+    vehicle = np.sort(rng.integers(0, n_vehicles, n_points))
+    seconds = np.concatenate([rng.choice(n_days * 86400, np.sum(vehicle == v), replace=False)
+                              for v in range(n_vehicles)])
+    runs = rng.integers(1, 6, n_points)
+    edge = np.repeat(rng.integers(0, n_edges, n_points), runs)[:n_points]
+    frame = pd.DataFrame({"VehicleNum": vehicle + 1000,
+                          "Time": pd.Timestamp("2014-08-03") + pd.to_timedelta(seconds, unit="s"),
+                          "matched_road": edge})
+    frame = frame.sort_values(["VehicleNum", "Time"]).reset_index(drop=True)
+    return frame.iloc[rng.permutation(n_points)].reset_index(drop=True)
+
+
+def test_hourly_traffic_matches_notebook():
+    n_edges, n_days = 40, 3
+    gdf = random_points(n_edges=n_edges, n_days=n_days)
+    gdf["Hour"] = gdf["Time"].dt.hour
+    expected, expected_points = notebook_traffic(gdf, range(n_edges), n_days)
+
+    traffic, hour = hourly_traffic(gdf["matched_road"].to_numpy(), gdf["VehicleNum"].to_numpy(),
+                                   gdf["Time"].to_numpy(), n_edges, n_days)
+    np.testing.assert_array_equal(hour, gdf["Hour"].to_numpy())
+    np.testing.assert_allclose(traffic, np.array([expected[road] for road in range(n_edges)]), rtol=1e-12)
+    np.testing.assert_allclose(point_traffic(traffic, gdf["matched_road"].to_numpy(), hour), expected_points,
+                               rtol=1e-12)
+
+
+def test_hourly_traffic_seconds_and_unmatched_points():
+    n_edges = 40
+    gdf = random_points(n_edges=n_edges, seed=1)
+    traffic, hour = hourly_traffic(gdf["matched_road"].to_numpy(), gdf["VehicleNum"].to_numpy(),
+                                   gdf["Time"].to_numpy(), n_edges, 3)
+    seconds = gdf["Time"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    np.testing.assert_array_equal(hourly_traffic(gdf["matched_road"].to_numpy(), gdf["VehicleNum"].to_numpy(),
+                                                 seconds, n_edges, 3)[0], traffic)
+
+    # 未匹配的点 (-1) 不计流量, 点流量为 0
+    edge = gdf["matched_road"].to_numpy().copy()
+    edge[::7] = -1
+    traffic, hour = hourly_traffic(edge, gdf["VehicleNum"].to_numpy(), seconds, n_edges, 3)
+    assert traffic.sum() > 0
+    assert (point_traffic(traffic, edge, hour)[edge < 0] == 0).all()
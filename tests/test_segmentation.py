@@ -0,0 +1,67 @@
+# segment_day against the per-row loop of the original preparation.py
+import numpy as np
+import pandas as pd
+
+from segmentation import segment_day
+
+
+def reference_segment(data, min_duration=600, max_duration=3000):
+    # 原 preparation.py 的逐行循环, 只去掉了读文件部分
+    results = []
+    for vehicle, group in data.groupby("VehicleNum"):
+        group = group.reset_index(drop=True)
+        start_idx = None
+        for i in range(len(group)):
+            if group.loc[i, "status"] == 1 and start_idx is None:
+                start_idx = i
+            elif group.loc[i, "status"] == 0 and start_idx is not None:
+                trajectory = group.loc[start_idx:i, ["longitude", "latitude"]].values.tolist()
+                start_time = group.loc[start_idx, "time"]
+                end_time = group.loc[i, "time"]
+                time_elapsed = (end_time - start_time).total_seconds()
+                if time_elapsed >= min_duration and time_elapsed <= max_duration:
+                    results.append({"VehicleNum": vehicle, "trajectory": trajectory, "start_time": start_time,
+                                    "end_time": end_time, "time_elapsed": time_elapsed})
+                start_idx = None
+    return results
+
+
+def random_day(n_vehicles=12, n_records=3000, seed=0):
+    # 车辆记录交错排列, 状态包含 0 / 1 以及循环中被忽略的其它值
+    rng = np.random.default_rng(seed)
+    vehicle = rng.integers(0, n_vehicles, n_records)
+    step = pd.to_timedelta(rng.integers(30, 400, n_records), unit="s")
+    time = pd.Timestamp("2018-10-01") + step.to_series().groupby(vehicle).cumsum().sort_index().to_numpy()
+    status = rng.choice([0, 1, 2], n_records, p=[0.3, 0.6, 0.1])
+    return pd.DataFrame({"VehicleNum": vehicle + 22000, "time": time, "status": status,
+                         "longitude": rng.uniform(113.8, 114.3, n_records),
+                         "latitude": rng.uniform(22.4, 22.8, n_records)})
+
+
+def test_segment_day_matches_row_loop():
+    for seed in range(3):
+        data = random_day(seed=seed)
+        expected = reference_segment(data)
+        trips = segment_day(data)
+        assert len(expected) > 10
+        assert len(trips["offsets"]) - 1 == len(expected)
+        for k, trip in enumerate(expected):
+            points = trips["points"][trips["offsets"][k]:trips["offsets"][k + 1]]
+            assert trips["VehicleNum"][k] == trip["VehicleNum"]
+            assert trips["start_time"][k] == trip["start_time"]
+            assert trips["end_time"][k] == trip["end_time"]
+            assert trips["time_elapsed"][k] == trip["time_elapsed"]
+            np.testing.assert_array_equal(points, trip["trajectory"])
+
+
+def test_segment_day_duration_bounds():
+    data = random_day(seed=3)
+    expected = reference_segment(data, min_duration=0, max_duration=1200)
+    trips = segment_day(data, min_duration=0, max_duration=1200)
+    np.testing.assert_array_equal(trips["time_elapsed"], [trip["time_elapsed"] for trip in expected])
+
+
+def test_segment_day_empty():
+    trips = segment_day(random_day().iloc[:0])
+    assert len(trips["offsets"]) == 1
+    assert trips["points"].shape == (0, 2)
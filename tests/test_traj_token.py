@@ -0,0 +1,41 @@
+# tokenize_batch against stacking process_trajectory over the trips
+from itertools import pairwise
+
+import numpy as np
+
+from traj_token import process_trajectory, tokenize_batch
+
+
+def random_trips(n_trips, input_dim, max_points, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_points + 1, n_trips)
+    offsets = np.zeros(n_trips + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return rng.normal(size=(offsets[-1], input_dim)), offsets
+
+
+def reference_tokens(points, offsets, max_length, input_dim):
+    trips = [points[start - offsets[0]:stop - offsets[0]].tolist() for start, stop in pairwise(offsets)]
+    return np.array([process_trajectory(trip, max_length, input_dim) for trip in trips], dtype=np.float32)
+
+
+def test_tokenize_batch_matches_process_trajectory():
+    for input_dim in (2, 4):
+        points, offsets = random_trips(50, input_dim, max_points=40, seed=input_dim)
+        np.testing.assert_array_equal(tokenize_batch(points, offsets, 64, input_dim),
+                                      reference_tokens(points, offsets, 64, input_dim))
+
+
+def test_tokenize_batch_truncates_like_process_trajectory():
+    # 轨迹长于 max_length 时两者都截断, 结束标记被丢弃
+    points, offsets = random_trips(30, 2, max_points=40, seed=5)
+    np.testing.assert_array_equal(tokenize_batch(points, offsets, 24, 2), reference_tokens(points, offsets, 24, 2))
+
+
+def test_tokenize_batch_offsets_not_starting_at_zero():
+    # 偏移量也可以是更大的偏移数组的一段, 不从 0 开始
+    points, offsets = random_trips(20, 2, max_points=10, seed=6)
+    first = offsets[5]
+    batch_points, batch_offsets = points[first:], offsets[5:]
+    np.testing.assert_array_equal(tokenize_batch(batch_points, batch_offsets, 16, 2),
+                                  reference_tokens(batch_points, batch_offsets, 16, 2))
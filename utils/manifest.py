@@ -0,0 +1,73 @@
+# Manifest of processed day files, used to skip unchanged days on incremental runs
+import hashlib
+import json
+import os
+
+
+def file_fingerprint(path, use_hash=False):
+    """
+    Identify the content of an input file by size and mtime, optionally by sha1.
+    """
+    stat = os.stat(path)
+    fingerprint = {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if use_hash:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        fingerprint["sha1"] = sha1.hexdigest()
+    return fingerprint
+
+
+class Manifest:
+    """
+    Per-day record of input fingerprints, processing parameters and outputs.
+
+    Args:
+        path (str): JSON file holding the manifest, created on the first save.
+        use_hash (bool): Compare inputs by sha1 instead of size and mtime.
+    """
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+        self.days = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.days = json.load(f)["days"]
+
+    def _same_input(self, recorded, input_path):
+        current = file_fingerprint(input_path, use_hash=self.use_hash and "sha1" in recorded)
+        if "sha1" in current:
+            return current["size"] == recorded["size"] and current["sha1"] == recorded["sha1"]
+        return all(current[key] == recorded[key] for key in ("path", "size", "mtime_ns"))
+
+    def is_fresh(self, name, input_path, params):
+        """
+        True if the day was processed from the same input with the same
+        parameters and its output is still on disk.
+        """
+        entry = self.days.get(name)
+        if entry is None or entry["params"] != params:
+            return False
+        if not os.path.exists(entry["output"]):
+            return False
+        return self._same_input(entry["input"], input_path)
+
+    def record(self, name, input_path, params, output_path, n_trips):
+        """
+        Record a finished day and checkpoint the manifest to disk right away.
+        """
+        self.days[name] = {
+            "input": file_fingerprint(input_path, use_hash=self.use_hash),
+            "params": params,
+            "output": output_path,
+            "n_trips": n_trips,
+        }
+        self.save()
+
+    def save(self):
+        # 先写临时文件再替换, 进程中断时不会留下损坏的 manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"days": self.days}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -1,15 +1,11 @@
-import pandas as pd
-import ast
+from trip_store import TripStore
 
 if __name__ == "__main__":
-    # Load the CSV file
-    file_path = "../data/results.csv"  # Replace with your actual file path
-    data = pd.read_csv(file_path)
-
-    # Parse the trajectory column as a list
-    data['trajectory'] = data['trajectory'].apply(ast.literal_eval)
-
-    # Calculate the maximum length of trajectory points
-    max_trajectory_length = data['trajectory'].apply(len).max()
-
-    print("Maximum length of trajectory points:", max_trajectory_length)
+    # Load the trip store
+    file_path = "../data/results.trips"  # Replace with your actual file path
+    stats = TripStore(file_path).stats()
+
+    # Statistics are collected during segmentation, no trajectory is read here
+    print("Maximum length of trajectory points:", stats["max_length"])
+    print("Length percentiles:", stats["length_percentiles"])
+    print("Trips per day:", stats["per_day"])
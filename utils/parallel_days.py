@@ -0,0 +1,146 @@
+# Fan the per-day preparation work out to a process pool and merge the partial outputs
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from manifest import Manifest
+from trip_store import merge_stores
+
+
+def add_parallel_args(parser):
+    """
+    Register the command line options shared by the preparation scripts.
+    """
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes, 0 means one per CPU core")
+    parser.add_argument("--partial-dir", default=None,
+                        help="folder for the per-day partial outputs (default: <output>.parts)")
+    parser.add_argument("--order", choices=["input", "completion"], default="input",
+                        help="merge partial outputs in input order (deterministic) or as days finish")
+    parser.add_argument("--keep-partials", action="store_true",
+                        help="keep the per-day partial outputs after merging")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep partial outputs with a manifest and skip days whose input and parameters are unchanged")
+    parser.add_argument("--hash", action="store_true",
+                        help="with --incremental, compare inputs by sha1 instead of size and mtime")
+    return parser
+
+
+def run_days(process_day, tasks, workers=1, order="input"):
+    """
+    Run `process_day(*args)` for every task and yield (name, result) pairs.
+
+    Args:
+        process_day (callable): Top-level function handling a single day.
+        tasks (list): (name, args) pairs, args being the tuple passed to process_day.
+        workers (int): Pool size, 1 runs in the current process, 0 uses all cores.
+        order (str): "input" yields in task order, "completion" as soon as a day is done.
+
+    Yields:
+        tuple: (name, result) for each task.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        for name, args in tasks:
+            yield name, process_day(*args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_day, *args): name for name, args in tasks}
+        if order == "completion":
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        else:
+            for future, name in futures.items():
+                yield name, future.result()
+
+
+def merge_partials(partial_paths, output_path):
+    """
+    Merge the per-day trip stores into one output store, in the given order.
+
+    The merge is written to a temporary folder that replaces the output only once it
+    succeeded, so a failed run leaves the previous output in place.
+    """
+    if not partial_paths:
+        raise ValueError("No trip store to merge")
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        merge_stores(partial_paths, tmp_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.replace(tmp_path, output_path)
+
+
+def partial_path(partial_dir, name):
+    """
+    Location of the partial trip store written for one day.
+    """
+    return os.path.join(partial_dir, f"{name}.trips")
+
+
+def remove_partials(paths, partial_dir, created):
+    """
+    Delete the partial stores a run wrote, and their folder only if the run created it.
+
+    The folder may be given with --partial-dir and hold other files, so it is never
+    removed recursively.
+    """
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+    if created:
+        try:
+            os.rmdir(partial_dir)
+        except OSError:
+            pass
+
+
+def prepare_days(process_day, tasks, args, params, extra_args=()):
+    """
+    Process every day file into a partial trip store and merge them into `args.output`.
+
+    With `--incremental` the partial stores are kept next to a manifest.json, days
+    whose input file and parameters are unchanged are reused as they are, and the
+    manifest is checkpointed after every finished day so an interrupted run
+    resumes where it stopped.
+
+    Args:
+        process_day (callable): Top-level function called as
+            process_day(name, file_path, output_path, *extra_args), returning the number of trips written.
+        tasks (list): (name, file_path) pairs in input order.
+        args (argparse.Namespace): Parsed options from `add_parallel_args`, plus `output`.
+        params (dict): JSON-serializable processing parameters; any change invalidates all days.
+        extra_args (tuple): Additional picklable arguments passed to every process_day call.
+    """
+    if not tasks:
+        raise ValueError("No day files to process")
+    partial_dir = args.partial_dir or args.output + ".parts"
+    created = not os.path.exists(partial_dir)
+    os.makedirs(partial_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(partial_dir, "manifest.json"), use_hash=args.hash) if args.incremental else None
+
+    finished, pending = [], []
+    for name, file_path in tasks:
+        if manifest is not None and manifest.is_fresh(name, file_path, params):
+            finished.append(name)
+            print(f"Skipping unchanged {name}")
+        else:
+            pending.append((name, (name, file_path, partial_path(partial_dir, name)) + tuple(extra_args)))
+
+    input_paths = dict(tasks)
+    for name, n_trips in run_days(process_day, pending, workers=args.workers, order=args.order):
+        if manifest is not None:
+            manifest.record(name, input_paths[name], params, partial_path(partial_dir, name), n_trips)
+        finished.append(name)
+        print(f"Finished processing {name} ({n_trips} trips)")
+
+    if args.order == "input":
+        finished = [name for name, _ in tasks if name in finished]
+    merge_partials([partial_path(partial_dir, name) for name in finished], args.output)
+    if manifest is None and not args.keep_partials:
+        remove_partials([partial_path(partial_dir, name) for name in finished], partial_dir, created)
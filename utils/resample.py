@@ -0,0 +1,161 @@
+# Fixed-K resampling of trips stored as flat points plus offsets
+#
+# Every trip is reduced (or stretched) to K points, so the models see sequences of
+# K + 2 tokens instead of every raw GPS point padded to the longest trip:
+#   arclength   K points evenly spaced along the travelled distance, all features interpolated
+#   dp          the K most significant Douglas-Peucker keypoints, padded when a trip has fewer
+# The token index column holds the (interpolated) index of the original point, so the
+# sampling density of the raw trajectory is not lost.
+import heapq
+
+import numpy as np
+
+RESAMPLE_METHODS = ["arclength", "dp"]
+
+
+def _planar(points):
+    # 经纬度近似投影到平面: 经度乘 cos(纬度), 距离单位为度
+    xy = np.array(points[:, :2], dtype=np.float64)
+    xy[:, 0] *= np.cos(np.radians(xy[:, 1]))
+    return xy
+
+
+def resample_arclength(points, offsets, k):
+    """
+    Resample every trip to k points evenly spaced along its path.
+
+    Trips without any movement are spaced evenly over their point indices instead.
+
+    Args:
+        points (np.ndarray): (n_points, n_features) points of all trips, longitude and latitude first.
+        offsets (np.ndarray): (n_trips + 1,) trip j owns points[offsets[j]:offsets[j + 1]], no empty trips.
+        k (int): Points per resampled trip.
+
+    Returns:
+        tuple: resampled points (n_trips, k, n_features) and the fractional 1-based
+            original index of every resampled point (n_trips, k).
+    """
+    offsets = np.asarray(offsets, dtype=np.int64) - offsets[0]
+    n_trips = len(offsets) - 1
+    lengths = np.diff(offsets)
+    starts, ends = offsets[:-1], offsets[1:]
+    trip_ids = np.repeat(np.arange(n_trips), lengths)
+    local = np.arange(len(points)) - starts[trip_ids]
+
+    xy = _planar(points)
+    step = np.zeros(len(points))
+    step[1:] = np.hypot(*(xy[1:] - xy[:-1]).T)
+    step[starts[starts < len(points)]] = 0
+    distance = np.cumsum(step)
+    distance -= distance[starts][trip_ids]
+    total = distance[ends - 1]
+
+    moving = total > 0
+    s = np.where(moving[trip_ids], distance / np.where(moving, total, 1)[trip_ids],
+                 local / np.maximum(lengths - 1, 1)[trip_ids])
+
+    # 每条轨迹的 s 在 [0, 1] 内单调不减, 加上 2 * 行程号后整体有序, 一次 searchsorted 即可
+    u = np.linspace(0, 1, k)
+    keys = 2.0 * trip_ids + s
+    targets = (2.0 * np.arange(n_trips)[:, None] + u[None, :]).ravel()
+    lo = np.searchsorted(keys, targets, side="right") - 1
+    first, last = np.repeat(starts, k), np.repeat(ends - 1, k)
+    lo = np.clip(lo, first, last)
+    hi = np.minimum(lo + 1, last)
+    span = s[hi] - s[lo]
+    frac = np.where(span > 0, (np.tile(u, n_trips) - s[lo]) / np.where(span > 0, span, 1), 0.0)
+    frac = np.clip(frac, 0, 1)
+
+    resampled = points[lo] + frac[:, None] * (points[hi] - points[lo])
+    position = local[lo] + frac + 1
+    return resampled.reshape(n_trips, k, -1), position.reshape(n_trips, k)
+
+
+def _farthest(xy, i, j):
+    # 点 i+1..j-1 到线段 (i, j) 的最大距离及其下标
+    a, b = xy[i], xy[j]
+    inner = xy[i + 1:j]
+    ab = b - a
+    norm = ab @ ab
+    t = np.clip((inner - a) @ ab / norm, 0, 1) if norm > 0 else np.zeros(len(inner))
+    d = np.hypot(*(inner - a - t[:, None] * ab).T)
+    m = int(np.argmax(d))
+    return d[m], i + 1 + m
+
+
+def douglas_peucker_k(xy, k):
+    """
+    Indices of the k most significant points of a polyline: Douglas-Peucker splitting
+    always the segment with the farthest point next, stopped after k points.
+
+    Returns:
+        np.ndarray: Sorted point indices, first and last point included, at most k of them.
+    """
+    n = len(xy)
+    if n <= k:
+        return np.arange(n)
+    if k == 1:
+        return np.array([0])
+    keep = [0, n - 1]
+    heap = []
+    if n > 2:
+        d, m = _farthest(xy, 0, n - 1)
+        heap.append((-d, 0, n - 1, m))
+    while len(keep) < k and heap:
+        _, i, j, m = heapq.heappop(heap)
+        keep.append(m)
+        for a, b in ((i, m), (m, j)):
+            if b - a > 1:
+                d, mm = _farthest(xy, a, b)
+                heapq.heappush(heap, (-d, a, b, mm))
+    return np.sort(np.array(keep))
+
+
+def resample_dp(points, offsets, k):
+    """
+    Keep the k most significant Douglas-Peucker keypoints of every trip.
+
+    Returns:
+        tuple: points (n_trips, k, n_features) zero-padded after each trip's keypoints,
+            1-based original index (n_trips, k) and the number of keypoints per trip.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64) - offsets[0]
+    n_trips = len(offsets) - 1
+    resampled = np.zeros((n_trips, k, points.shape[1]), dtype=np.float64)
+    position = np.zeros((n_trips, k), dtype=np.float64)
+    counts = np.zeros(n_trips, dtype=np.int64)
+    xy = _planar(points)
+    for j in range(n_trips):
+        start, end = offsets[j], offsets[j + 1]
+        keep = douglas_peucker_k(xy[start:end], k)
+        resampled[j, :len(keep)] = points[start + keep]
+        position[j, :len(keep)] = keep + 1
+        counts[j] = len(keep)
+    return resampled, position, counts
+
+
+def tokenize_resampled(points, offsets, k, method="arclength"):
+    """
+    Tokens of a batch of trips resampled to k points: start token, k points with their
+    original index, end token, then zero padding for dp trips with fewer keypoints.
+
+    Returns:
+        tuple: tokens float32 (n_trips, k + 2, n_features + 1) and lengths (n_trips,)
+            counting the start and end tokens.
+    """
+    n_trips = len(offsets) - 1
+    input_dim = points.shape[1]
+    if method == "arclength":
+        resampled, position = resample_arclength(points, offsets, k)
+        counts = np.full(n_trips, k, dtype=np.int64)
+    elif method == "dp":
+        resampled, position, counts = resample_dp(points, offsets, k)
+    else:
+        raise ValueError(f"Unknown resampling method: {method}")
+
+    tokens = np.zeros((n_trips, k + 2, input_dim + 1), dtype=np.float32)
+    tokens[:, 0] = [-20, -20] + [0] * (input_dim - 2) + [-1]
+    tokens[:, 1:k + 1, :input_dim] = resampled
+    tokens[:, 1:k + 1, input_dim] = position
+    tokens[np.arange(n_trips), counts + 1] = [20, 20] + [0] * (input_dim - 2) + [-2]
+    return tokens, counts + 2
@@ -0,0 +1,410 @@
+# Vectorized trip segmentation for the taxi GPS records, shared by the Shenzhen and Chengdu pipelines
+#
+# Usage: python segmentation.py --city chengdu --workers 8
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from parallel_days import add_parallel_args, merge_partials, prepare_days, remove_partials
+from trip_store import write_trips
+
+# 每个城市的数据格式: 列名映射, 轨迹点特征, 时间格式和输入输出位置
+CITY_CONFIGS = {
+    "shenzhen": {
+        "columns": {"vehicle": "VehicleNum", "status": "status", "time": "time"},
+        "feature": ["longitude", "latitude"],
+        # 深圳数据只有时分秒, 日期取自文件名
+        "time_format": "%Y-%m-%d %H:%M:%S",
+        "date_from_filename": True,
+        "data_folder": "../data/taxi",
+        "dates": ["2018-10-01", "2018-10-30"],
+        "output": "../data/results.trips",
+    },
+    "chengdu": {
+        "columns": {"vehicle": "VehicleNum", "status": "Status", "time": "Time"},
+        "feature": ["Lng", "Lat", "Hour", "traffic"],
+        "time_format": "%Y/%m/%d %H:%M:%S",
+        "date_from_filename": False,
+        "data_folder": "../data",
+        "file_suffix": "traffic_average.csv",
+        "output": "../data/results_chengdu_{n_feature}d.trips",
+    },
+}
+
+
+def sort_by_vehicle(data, vehicle_col="VehicleNum"):
+    """
+    Stable sort of the records by vehicle, keeping the original row order inside
+    every vehicle (the same order `groupby` hands each group to the old loop).
+
+    Args:
+        data (pd.DataFrame): Raw records of one day.
+        vehicle_col (str): Name of the vehicle id column.
+
+    Returns:
+        pd.DataFrame: Sorted records with a fresh RangeIndex.
+    """
+    order = np.argsort(data[vehicle_col].to_numpy(), kind="stable")
+    return data.iloc[order].reset_index(drop=True)
+
+
+def find_trip_bounds(vehicle, status):
+    """
+    Find passenger trips as (start_offset, end_offset) pairs over vehicle-sorted
+    records. A trip opens on the first status 1 of an idle vehicle and closes on
+    the next status 0 of the same vehicle, the closing record included.
+
+    Args:
+        vehicle (np.ndarray): Vehicle id per record, grouped contiguously.
+        status (np.ndarray): Passenger status per record.
+
+    Returns:
+        tuple: (starts, ends, open_starts) int64 arrays. starts/ends bound the
+            closed trips, open_starts are trips still open at the end of their
+            vehicle group.
+    """
+    n = len(status)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = vehicle[1:] != vehicle[:-1]
+
+    # 状态机: 1 打开行程, 0 关闭行程, 其它值保持上一状态
+    mark = np.where(status == 1, 1, np.where(status == 0, 0, -1))
+    mark[group_start & (mark == -1)] = 0
+    anchor = np.where(mark != -1, np.arange(n), 0)
+    np.maximum.accumulate(anchor, out=anchor)
+    is_open = mark[anchor] == 1
+
+    was_open = np.zeros(n, dtype=bool)
+    was_open[1:] = is_open[:-1]
+    was_open[group_start] = False
+
+    starts = np.flatnonzero(is_open & ~was_open)
+    ends = np.flatnonzero((status == 0) & was_open)
+
+    # 起点与终点在同一车辆内交替出现, 每个终点对应它之前最近的起点
+    matched = np.searchsorted(starts, ends) - 1
+    closed_starts = starts[matched]
+    open_mask = np.ones(len(starts), dtype=bool)
+    open_mask[matched] = False
+    return closed_starts, ends, starts[open_mask]
+
+
+def filter_duration(starts, ends, time_ns, min_duration=600, max_duration=3000):
+    """
+    Keep the trips whose elapsed time lies in [min_duration, max_duration] seconds.
+
+    Args:
+        starts (np.ndarray): Start offsets of the trips.
+        ends (np.ndarray): End offsets of the trips.
+        time_ns (np.ndarray): Record timestamps as int64 nanoseconds.
+        min_duration (float): Shortest accepted trip in seconds.
+        max_duration (float): Longest accepted trip in seconds.
+
+    Returns:
+        tuple: Filtered (starts, ends, time_elapsed) arrays.
+    """
+    time_elapsed = (time_ns[ends] - time_ns[starts]) / 1e9
+    keep = (time_elapsed >= min_duration) & (time_elapsed <= max_duration)
+    return starts[keep], ends[keep], time_elapsed[keep]
+
+
+def ragged_index(starts, ends):
+    """
+    Row indices of all records covered by the [start, end] ranges, concatenated.
+
+    Returns:
+        tuple: (index, offsets) where trip k owns index[offsets[k]:offsets[k + 1]].
+    """
+    lengths = ends - starts + 1
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    index = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1] - starts, lengths)
+    return index, offsets
+
+
+def segment_day(data, feature=("longitude", "latitude"), vehicle_col="VehicleNum",
+                status_col="status", time_col="time", min_duration=600, max_duration=3000):
+    """
+    Cut one day of records into passenger trips without any per-row Python loop.
+
+    Args:
+        data (pd.DataFrame): Records with `time_col` already parsed to datetime.
+        feature (list): Columns stored for every trajectory point.
+        vehicle_col (str): Name of the vehicle id column.
+        status_col (str): Name of the passenger status column.
+        time_col (str): Name of the timestamp column.
+        min_duration (float): Shortest accepted trip in seconds.
+        max_duration (float): Longest accepted trip in seconds.
+
+    Returns:
+        dict: Trip columns "VehicleNum", "start_time", "end_time", "time_elapsed",
+            the flat "points" array of shape (n_points, len(feature)) and the
+            "offsets" array of length n_trips + 1.
+    """
+    data = sort_by_vehicle(data, vehicle_col)
+    vehicle = data[vehicle_col].to_numpy()
+    time_ns = data[time_col].to_numpy().astype("datetime64[ns]").astype(np.int64)
+
+    starts, ends, _ = find_trip_bounds(vehicle, data[status_col].to_numpy())
+    starts, ends, time_elapsed = filter_duration(starts, ends, time_ns, min_duration, max_duration)
+    return gather_trips(data, starts, ends, time_elapsed, feature, vehicle_col, time_col)
+
+
+def gather_trips(data, starts, ends, time_elapsed, feature, vehicle_col, time_col):
+    """
+    Collect the trip columns and the flat trajectory points of the [start, end] ranges.
+    """
+    index, offsets = ragged_index(starts, ends)
+    time = data[time_col].to_numpy()
+    return {
+        "VehicleNum": data[vehicle_col].to_numpy()[starts],
+        "start_time": time[starts],
+        "end_time": time[ends],
+        "time_elapsed": time_elapsed,
+        "points": data[list(feature)].to_numpy()[index],
+        "offsets": offsets,
+    }
+
+
+class StreamingSegmenter:
+    """
+    Segment records fed in time-ordered chunks, stitching trips across chunk and
+    day-file boundaries. Between chunks only the rows of the still open trips are
+    kept (one buffer per vehicle with a passenger on board), so memory depends on
+    the chunk size and the fleet size, not on the length of the corpus.
+
+    Args:
+        feature (list): Columns stored for every trajectory point.
+        vehicle_col (str): Name of the vehicle id column.
+        status_col (str): Name of the passenger status column.
+        time_col (str): Name of the timestamp column, already parsed to datetime.
+        min_duration (float): Shortest accepted trip in seconds.
+        max_duration (float): Longest accepted trip in seconds.
+    """
+    def __init__(self, feature=("longitude", "latitude"), vehicle_col="VehicleNum",
+                 status_col="status", time_col="time", min_duration=600, max_duration=3000):
+        self.feature = list(feature)
+        self.vehicle_col = vehicle_col
+        self.status_col = status_col
+        self.time_col = time_col
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.carry = None
+
+    @property
+    def open_trips(self):
+        if self.carry is None or len(self.carry) == 0:
+            return 0
+        return self.carry[self.vehicle_col].nunique()
+
+    def feed(self, chunk):
+        """
+        Segment the next chunk of records.
+
+        Returns:
+            dict: Trips completed within this chunk, same layout as `segment_day`.
+        """
+        columns = [self.vehicle_col, self.status_col, self.time_col] + self.feature
+        chunk = chunk[list(dict.fromkeys(columns))]
+        # 上一块未结束的行程排在前面, 稳定排序后仍位于该车辆本块记录之前
+        data = chunk if self.carry is None else pd.concat([self.carry, chunk], ignore_index=True)
+        data = sort_by_vehicle(data, self.vehicle_col)
+        vehicle = data[self.vehicle_col].to_numpy()
+        time_ns = data[self.time_col].to_numpy().astype("datetime64[ns]").astype(np.int64)
+
+        starts, ends, open_starts = find_trip_bounds(vehicle, data[self.status_col].to_numpy())
+        starts, ends, time_elapsed = filter_duration(starts, ends, time_ns, self.min_duration, self.max_duration)
+        trips = gather_trips(data, starts, ends, time_elapsed, self.feature, self.vehicle_col, self.time_col)
+
+        # 未结束的行程: 从起点保留到该车辆本块最后一条记录
+        group_last = np.flatnonzero(np.append(vehicle[1:] != vehicle[:-1], True))
+        open_ends = group_last[np.searchsorted(group_last, open_starts)]
+        # 已超过最长时长的行程无论何时结束都会被过滤, 只保留起点以维持状态
+        overdue = (time_ns[open_ends] - time_ns[open_starts]) / 1e9 > self.max_duration
+        open_ends = np.where(overdue, open_starts, open_ends)
+        index, _ = ragged_index(open_starts, open_ends)
+        self.carry = data.iloc[index].reset_index(drop=True)
+        return trips
+
+
+def list_day_files(config, data_folder):
+    """
+    Day files of a city as (name, file_path) pairs in chronological order.
+    """
+    if "dates" in config:
+        tasks = []
+        for date in pd.date_range(*config["dates"], freq="D"):
+            name = date.strftime("%Y-%m-%d").lstrip("0").replace("-0", "-")
+            file_path = os.path.join(data_folder, f"{name}.csv")
+            if not os.path.exists(file_path):
+                print(f"File not found:{file_path}")
+                continue
+            tasks.append((name, file_path))
+        return tasks
+
+    # 文件名排序, 保证合并结果与目录遍历顺序无关
+    return [(os.path.splitext(filename)[0], os.path.join(data_folder, filename))
+            for filename in sorted(os.listdir(data_folder)) if filename.endswith(config["file_suffix"])]
+
+
+def load_day(config, name, file_path):
+    """
+    Read one day file, keeping only the columns segmentation needs, and parse its timestamps.
+    """
+    columns = config["columns"]
+    usecols = list(dict.fromkeys([columns["vehicle"], columns["status"], columns["time"]] + config["feature"]))
+    data = pd.read_csv(file_path, usecols=usecols)
+    time_col = columns["time"]
+    if config["date_from_filename"]:
+        data[time_col] = pd.to_datetime(name + " " + data[time_col], format=config["time_format"])
+    else:
+        data[time_col] = pd.to_datetime(data[time_col], format=config["time_format"])
+    return data
+
+
+def iter_day_chunks(config, name, file_path, chunksize):
+    """
+    Read one day file in chunks of `chunksize` rows, with parsed timestamps.
+    """
+    columns = config["columns"]
+    usecols = list(dict.fromkeys([columns["vehicle"], columns["status"], columns["time"]] + config["feature"]))
+    time_col = columns["time"]
+    for data in pd.read_csv(file_path, usecols=usecols, chunksize=chunksize):
+        if config["date_from_filename"]:
+            data[time_col] = pd.to_datetime(name + " " + data[time_col], format=config["time_format"])
+        else:
+            data[time_col] = pd.to_datetime(data[time_col], format=config["time_format"])
+        yield data
+
+
+def stream_days(tasks, config, output_path, chunksize, partial_dir=None, keep_partials=False):
+    """
+    Streaming mode: feed all day files in time order through one StreamingSegmenter,
+    so trips that cross midnight are kept. Each chunk's completed trips are written
+    as a partial store under partial_dir (default <output>.stream-parts, apart from the
+    <output>.parts cache of --incremental) and merged at the end.
+    """
+    if not tasks:
+        raise ValueError("No day files to process")
+    columns = config["columns"]
+    segmenter = StreamingSegmenter(feature=config["feature"], vehicle_col=columns["vehicle"],
+                                   status_col=columns["status"], time_col=columns["time"],
+                                   min_duration=config["min_duration"], max_duration=config["max_duration"])
+    partial_dir = partial_dir or output_path + ".stream-parts"
+    created = not os.path.exists(partial_dir)
+    os.makedirs(partial_dir, exist_ok=True)
+    partial_paths = []
+    for name, file_path in tasks:
+        n_trips = 0
+        for chunk in iter_day_chunks(config, name, file_path, chunksize):
+            trips = segmenter.feed(chunk)
+            path = os.path.join(partial_dir, f"chunk_{len(partial_paths):05d}.trips")
+            write_trips(path, trips, config["feature"], day=name)
+            partial_paths.append(path)
+            n_trips += len(trips["offsets"]) - 1
+        print(f"Finished processing {name} ({n_trips} trips, {segmenter.open_trips} still open)")
+
+    merge_partials(partial_paths, output_path)
+    if not keep_partials:
+        remove_partials(partial_paths, partial_dir, created)
+
+
+def segment_config(data, config):
+    """
+    `segment_day` with the column mapping, features and duration window of a city config.
+    """
+    columns = config["columns"]
+    return segment_day(data, feature=config["feature"], vehicle_col=columns["vehicle"],
+                       status_col=columns["status"], time_col=columns["time"],
+                       min_duration=config["min_duration"], max_duration=config["max_duration"])
+
+
+def process_day(name, file_path, output_path, config):
+    data = load_day(config, name, file_path)
+    trips = segment_config(data, config)
+    # 每天的结果单独写出, 不在内存中累积整个月的行程
+    write_trips(output_path, trips, config["feature"], day=name)
+    return len(trips["offsets"]) - 1
+
+
+def benchmark(tasks, config):
+    """
+    Time reading and segmentation of every day file separately, without writing anything.
+    """
+    print(f"{'day':<32}{'rows':>12}{'trips':>10}{'read s':>10}{'segment s':>12}{'rows/s':>14}")
+    total_rows, total_read, total_segment = 0, 0.0, 0.0
+    for name, file_path in tasks:
+        tic = time.perf_counter()
+        data = load_day(config, name, file_path)
+        toc = time.perf_counter()
+        trips = segment_config(data, config)
+        done = time.perf_counter()
+        n_trips = len(trips["offsets"]) - 1
+        print(f"{name:<32}{len(data):>12}{n_trips:>10}{toc - tic:>10.2f}{done - toc:>12.3f}{len(data) / max(done - toc, 1e-9):>14.0f}")
+        total_rows += len(data)
+        total_read += toc - tic
+        total_segment += done - toc
+    print(f"{'total':<32}{total_rows:>12}{'':>10}{total_read:>10.2f}{total_segment:>12.3f}{total_rows / max(total_segment, 1e-9):>14.0f}")
+
+
+def main(argv=None, city=None):
+    """
+    Command line entry point shared by both cities.
+
+    Args:
+        argv (list): Arguments to parse, defaults to sys.argv.
+        city (str): Default city, used by the preparation.py / preparation_cd.py wrappers.
+    """
+    parser = argparse.ArgumentParser(description="Cut taxi GPS records into passenger trips")
+    parser.add_argument("--city", choices=sorted(CITY_CONFIGS), default=city, required=city is None)
+    parser.add_argument("--data-folder", default=None, help="folder with the day files (default from the city config)")
+    parser.add_argument("--output", default=None, help="output trip store (default from the city config)")
+    parser.add_argument("--feature", default=None, help="comma separated point columns, overrides the city config")
+    parser.add_argument("--min-duration", type=float, default=600)
+    parser.add_argument("--max-duration", type=float, default=3000)
+    parser.add_argument("--benchmark", action="store_true", help="only time reading and segmentation per day")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the days in order in chunks and keep trips that cross midnight")
+    parser.add_argument("--chunksize", type=int, default=1000000, help="rows per chunk in --stream mode")
+    args = add_parallel_args(parser).parse_args(argv)
+
+    config = copy.deepcopy(CITY_CONFIGS[args.city])
+    if args.feature:
+        config["feature"] = args.feature.split(",")
+    config["min_duration"], config["max_duration"] = args.min_duration, args.max_duration
+    data_folder = args.data_folder or config["data_folder"]
+    args.output = args.output or config["output"].format(n_feature=len(config["feature"]))
+
+    # 数据目录来自用户输入, 在这里检查并给出用法错误, 而不是 os.listdir / prepare_days 的异常栈
+    if not os.path.isdir(data_folder):
+        parser.error(f"data folder {data_folder} does not exist")
+    tasks = list_day_files(config, data_folder)
+    if not tasks:
+        parser.error(f"no day files found in {data_folder}")
+    if args.benchmark:
+        benchmark(tasks, config)
+        return
+    if args.stream:
+        if args.incremental or args.hash or args.workers != 1 or args.order != "input":
+            parser.error("--stream runs sequentially and cannot be combined with "
+                         "--incremental, --hash, --workers or --order")
+        stream_days(tasks, config, args.output, args.chunksize, args.partial_dir, args.keep_partials)
+        print(f"Trips saved to {args.output}")
+        return
+
+    params = {key: config[key] for key in ("columns", "feature", "time_format", "min_duration", "max_duration")}
+    prepare_days(process_day, tasks, args, params, extra_args=(config,))
+
+    print(f"Trips saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
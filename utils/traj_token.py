@@ -1,6 +1,15 @@
 # A script to convert original trajectory into tokens
-import pandas as pd
+import argparse
 import csv
+import json
+import os
+
+import numpy as np
+
+from parallel_days import run_days
+from resample import RESAMPLE_METHODS, tokenize_resampled
+from trip_store import TripStore
+
 
 def process_trajectory(trajectory, max_length=2048, input_dim = 2):
     """
@@ -25,7 +34,7 @@ def process_trajectory(trajectory, max_length=2048, input_dim = 2):
     processed_traj = [start_token] + transformed_traj + [end_token]
     
     # Pad or truncate to the max length
-    if len(processed_traj) < max_length:
+    if len(processed_traj) <= max_length:
         processed_traj.extend([padding_token] * (max_length - len(processed_traj)))
     else:
         print("Warning: Max length is not correct.")
@@ -34,29 +43,289 @@ def process_trajectory(trajectory, max_length=2048, input_dim = 2):
     return processed_traj
 
 
-if __name__ == "__main__":
-    num_features = 4
-    file_path = f"../data/results_chengdu_{num_features}d.csv"  # Replace with your actual file path
-    output_path = f"../data/token_traj_chengdu_{num_features}d.csv"
-    
-    # Open input and output files
-    with open(file_path, "r") as infile, open(output_path, "w", newline="") as outfile:
-        reader = csv.DictReader(infile)
+def tokenize_batch(points, offsets, max_length, input_dim):
+    """
+    Vectorized `process_trajectory` for a batch of trips stored as flat points plus offsets.
+
+    Args:
+        points (np.ndarray): (n_points, input_dim) points of all trips in the batch.
+        offsets (np.ndarray): (n_trips + 1,) trip k owns points[offsets[k]:offsets[k + 1]].
+        max_length (int): Padded sequence length.
+        input_dim (int): Number of features per point.
+
+    Returns:
+        np.ndarray: float32 array of shape (n_trips, max_length, input_dim + 1), identical
+            to stacking `process_trajectory` over the trips.
+    """
+    n_trips = len(offsets) - 1
+    lengths = np.diff(offsets)
+    tokens = np.zeros((n_trips, max_length, input_dim + 1), dtype=np.float32)
+
+    tokens[:, 0] = [-20, -20] + [0] * (input_dim - 2) + [-1]
+
+    # 第 k 条轨迹的第 i 个点放在位置 i+1, 最后一维是点的序号
+    trip_ids = np.repeat(np.arange(n_trips), lengths)
+    position = np.arange(len(points)) - np.repeat(offsets[:-1] - offsets[0], lengths) + 1
+    keep = position < max_length
+    tokens[trip_ids[keep], position[keep], :input_dim] = points[keep]
+    tokens[trip_ids[keep], position[keep], input_dim] = position[keep]
+
+    end_position = lengths + 1
+    has_end = end_position < max_length
+    tokens[np.flatnonzero(has_end), end_position[has_end]] = [20, 20] + [0] * (input_dim - 2) + [-2]
+
+    if not has_end.all():
+        print(f"Warning: Max length is not correct, {int((~has_end).sum())} trajectories truncated.")
+    return tokens
+
+
+def _fill_token_tensor(store_path, output_path, start, stop, max_length, batch_size):
+    # 每个进程只写自己负责的行区间, 多个进程可以同时写同一个 memmap 文件
+    store = TripStore(store_path)
+    tokens = np.load(os.path.join(output_path, "tokens.npy"), mmap_mode="r+")
+    input_dim = len(store.feature)
+    for batch_start in range(start, stop, batch_size):
+        trips = store.read(batch_start, min(batch_start + batch_size, stop))
+        tokens[batch_start:batch_start + len(trips["offsets"]) - 1] = tokenize_batch(
+            trips["points"], trips["offsets"], max_length, input_dim)
+    tokens.flush()
+    return stop - start
+
+
+def shard_ranges(n_trips, shard_size):
+    """
+    Split [0, n_trips) into contiguous (name, (start, stop)) shards.
+    """
+    return [(f"shard {start}-{min(start + shard_size, n_trips)}", (start, min(start + shard_size, n_trips)))
+            for start in range(0, n_trips, shard_size)]
+
+
+def write_token_tensor(store, output_path, max_length, batch_size=1024, workers=1, shard_size=65536):
+    """
+    Tokenize a whole trip store into a fixed-shape float32 tensor on disk.
+
+    The output folder holds tokens.npy (n_trips, max_length, input_dim + 1), the target
+    time_elapsed.npy (n_trips,), lengths.npy with the real sequence length of each trip
+    (points plus start and end tokens, capped at max_length) and meta.json. The arrays are
+    filled batch by batch through memory maps, so only one batch is in RAM at a time.
+
+    With workers > 1 the trips are cut into shards of `shard_size` that a process pool
+    tokenizes in parallel, each shard writing its own rows of the preallocated tokens.npy,
+    so the result is a single file in the original trip order.
+    """
+    input_dim = len(store.feature)
+    n_trips = len(store)
+    os.makedirs(output_path, exist_ok=True)
+
+    tokens = np.lib.format.open_memmap(os.path.join(output_path, "tokens.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n_trips, max_length, input_dim + 1))
+    del tokens
+    tasks = [(name, (store.path, output_path, start, stop, max_length, batch_size))
+             for name, (start, stop) in shard_ranges(n_trips, shard_size)]
+    for _ in run_days(_fill_token_tensor, tasks, workers=workers, order="completion"):
+        pass
+
+    np.save(os.path.join(output_path, "time_elapsed.npy"),
+            np.asarray(store.columns["time_elapsed"], dtype=np.float32))
+    np.save(os.path.join(output_path, "lengths.npy"),
+            np.minimum(store.lengths() + 2, max_length).astype(np.int64))
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump({"n_trips": n_trips, "max_length": max_length, "input_dim": input_dim,
+                   "feature": store.feature}, f)
+
+
+def load_token_tensor(path):
+    """
+    Open a tensor written by `write_token_tensor` without reading it into memory.
+
+    Returns:
+        tuple: (tokens, time_elapsed) memory-mapped arrays.
+    """
+    tokens = np.load(os.path.join(path, "tokens.npy"), mmap_mode="r")
+    time_elapsed = np.load(os.path.join(path, "time_elapsed.npy"), mmap_mode="r")
+    return tokens, time_elapsed
+
+
+def pack_batch(points, offsets):
+    """
+    Tokens of a batch of trips without padding: start token, points with their index,
+    end token, all trips concatenated.
+
+    Returns:
+        tuple: (tokens, token_offsets) with tokens of shape (n_points + 2 * n_trips, input_dim + 1)
+            and trip k owning tokens[token_offsets[k]:token_offsets[k + 1]].
+    """
+    n_trips = len(offsets) - 1
+    input_dim = points.shape[1]
+    lengths = np.diff(offsets)
+    token_offsets = np.zeros(n_trips + 1, dtype=np.int64)
+    np.cumsum(lengths + 2, out=token_offsets[1:])
+    tokens = np.zeros((token_offsets[-1], input_dim + 1), dtype=np.float32)
+
+    tokens[token_offsets[:-1]] = [-20, -20] + [0] * (input_dim - 2) + [-1]
+    tokens[token_offsets[1:] - 1] = [20, 20] + [0] * (input_dim - 2) + [-2]
+
+    trip_ids = np.repeat(np.arange(n_trips), lengths)
+    position = np.arange(len(points)) - np.repeat(offsets[:-1] - offsets[0], lengths) + 1
+    rows = token_offsets[trip_ids] + position
+    tokens[rows, :input_dim] = points
+    tokens[rows, input_dim] = position
+    return tokens, token_offsets
+
+
+def _fill_packed_tokens(store_path, output_path, start, stop, batch_size):
+    store = TripStore(store_path)
+    tokens = np.load(os.path.join(output_path, "tokens.npy"), mmap_mode="r+")
+    offsets = np.load(os.path.join(output_path, "offsets.npy"), mmap_mode="r")
+    for batch_start in range(start, stop, batch_size):
+        trips = store.read(batch_start, min(batch_start + batch_size, stop))
+        batch_tokens, _ = pack_batch(trips["points"], trips["offsets"])
+        tokens[offsets[batch_start]:offsets[batch_start] + len(batch_tokens)] = batch_tokens
+    tokens.flush()
+    return stop - start
+
+
+def write_packed_tokens(store, output_path, batch_size=1024, workers=1, shard_size=65536):
+    """
+    Write the tokens of a trip store without padding: tokens.npy (n_tokens, input_dim + 1)
+    with all trips concatenated, offsets.npy (n_trips + 1,), time_elapsed.npy and meta.json.
+    Padding happens per batch at load time, see prediction/dataset.py.
+
+    The offsets are known from the trip lengths up front, so with workers > 1 the shards
+    are tokenized in parallel straight into their slices of tokens.npy.
+    """
+    input_dim = len(store.feature)
+    n_trips = len(store)
+    os.makedirs(output_path, exist_ok=True)
+
+    offsets = np.zeros(n_trips + 1, dtype=np.int64)
+    np.cumsum(store.lengths() + 2, out=offsets[1:])
+    np.save(os.path.join(output_path, "offsets.npy"), offsets)
+    tokens = np.lib.format.open_memmap(os.path.join(output_path, "tokens.npy"), mode="w+",
+                                       dtype=np.float32, shape=(int(offsets[-1]), input_dim + 1))
+    del tokens
+    tasks = [(name, (store.path, output_path, start, stop, batch_size))
+             for name, (start, stop) in shard_ranges(n_trips, shard_size)]
+    for _ in run_days(_fill_packed_tokens, tasks, workers=workers, order="completion"):
+        pass
+
+    np.save(os.path.join(output_path, "time_elapsed.npy"),
+            np.asarray(store.columns["time_elapsed"], dtype=np.float32))
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump({"n_trips": n_trips, "max_length": int(np.diff(offsets).max(initial=0)),
+                   "input_dim": input_dim, "feature": store.feature, "packed": True}, f)
+
+
+def _fill_resampled_tokens(store_path, output_path, start, stop, k, method, batch_size):
+    store = TripStore(store_path)
+    tokens = np.load(os.path.join(output_path, "tokens.npy"), mmap_mode="r+")
+    lengths = np.load(os.path.join(output_path, "lengths.npy"), mmap_mode="r+")
+    for batch_start in range(start, stop, batch_size):
+        trips = store.read(batch_start, min(batch_start + batch_size, stop))
+        batch_stop = batch_start + len(trips["offsets"]) - 1
+        tokens[batch_start:batch_stop], lengths[batch_start:batch_stop] = tokenize_resampled(
+            trips["points"], trips["offsets"], k, method)
+    tokens.flush()
+    lengths.flush()
+    return stop - start
+
+
+def write_resampled_tensor(store, output_path, k, method="arclength", batch_size=1024, workers=1, shard_size=65536):
+    """
+    Tokenize a trip store with every trip resampled to k points (see resample.py).
+
+    The folder has the layout of `write_token_tensor` with max_length = k + 2, so
+    TrajectoryDataset and the training engine read it unchanged; meta.json also
+    records the resampling method and k.
+    """
+    input_dim = len(store.feature)
+    n_trips = len(store)
+    os.makedirs(output_path, exist_ok=True)
+
+    tokens = np.lib.format.open_memmap(os.path.join(output_path, "tokens.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n_trips, k + 2, input_dim + 1))
+    lengths = np.lib.format.open_memmap(os.path.join(output_path, "lengths.npy"), mode="w+",
+                                        dtype=np.int64, shape=(n_trips,))
+    del tokens, lengths
+    tasks = [(name, (store.path, output_path, start, stop, k, method, batch_size))
+             for name, (start, stop) in shard_ranges(n_trips, shard_size)]
+    for _ in run_days(_fill_resampled_tokens, tasks, workers=workers, order="completion"):
+        pass
+
+    np.save(os.path.join(output_path, "time_elapsed.npy"),
+            np.asarray(store.columns["time_elapsed"], dtype=np.float32))
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump({"n_trips": n_trips, "max_length": k + 2, "input_dim": input_dim,
+                   "feature": store.feature, "resample": {"method": method, "k": k}}, f)
+
+
+def write_token_csv(store, output_path, max_length):
+    """
+    Original text output: one padded token list per CSV row.
+    """
+    input_dim = len(store.feature)
+    time_elapsed = store.columns["time_elapsed"]
+
+    # Open output file
+    with open(output_path, "w", newline="") as outfile:
         fieldnames = ["processed_trajectory", "time_elapsed"]
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
 
-        for row in reader:
-            # Parse trajectory as a Python list
-            trajectory = eval(row["trajectory"])  # Convert string to list safely
+        for k in range(len(store)):
+            # Read the trajectory points straight from the trip store
+            trajectory = store.trajectory(k).tolist()
             
             # Process the trajectory
-            processed_trajectory = process_trajectory(trajectory, input_dim=num_features)
+            processed_trajectory = process_trajectory(trajectory, max_length=max_length, input_dim=input_dim)
 
             # Write processed data to the output file
             writer.writerow({
                 "processed_trajectory": processed_trajectory,
-                "time_elapsed": row["time_elapsed"]
+                "time_elapsed": time_elapsed[k]
             })
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert segmented trips into model tokens")
+    parser.add_argument("--num-features", type=int, default=4)
+    parser.add_argument("--input", default=None, help="trip store (default: ../data/results_chengdu_<n>d.trips)")
+    parser.add_argument("--output", default=None, help="output file or folder")
+    parser.add_argument("--format", choices=["csv", "npy", "packed", "resampled"], default="csv",
+                        help="csv: padded token lists as text, npy: memory-mapped float32 tensor folder, "
+                             "packed: concatenated tokens plus offsets without padding, "
+                             "resampled: npy folder with every trip resampled to --k points")
+    parser.add_argument("--k", type=int, default=128, help="points per trip in resampled mode")
+    parser.add_argument("--method", choices=RESAMPLE_METHODS, default="arclength",
+                        help="resampled mode: even spacing along the path or Douglas-Peucker keypoints")
+    parser.add_argument("--max-length", type=int, default=None, help="padded length (default: from stats.json)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="trips per batch in npy / packed / resampled mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes tokenizing shards in npy / packed / resampled mode, 0 means one per CPU core")
+    parser.add_argument("--shard-size", type=int, default=65536, help="trips per shard with --workers")
+    args = parser.parse_args()
+
+    num_features = args.num_features
+    file_path = args.input or f"../data/results_chengdu_{num_features}d.trips"  # Replace with your actual file path
+    extension = {"csv": ".csv", "npy": ".tokens", "packed": ".packed",
+                 "resampled": f"_{args.method}{args.k}.tokens"}[args.format]
+    output_path = args.output or f"../data/token_traj_chengdu_{num_features}d{extension}"
+
+    store = TripStore(file_path)
+
+    # Longest trajectory plus the start and end tokens, read from the stats sidecar
+    max_length = args.max_length or store.stats()["max_length"] + 2
+
+    if args.format == "csv":
+        write_token_csv(store, output_path, max_length)
+    elif args.format == "npy":
+        write_token_tensor(store, output_path, max_length, batch_size=args.batch_size,
+                           workers=args.workers, shard_size=args.shard_size)
+    elif args.format == "packed":
+        write_packed_tokens(store, output_path, batch_size=args.batch_size,
+                            workers=args.workers, shard_size=args.shard_size)
+    else:
+        write_resampled_tensor(store, output_path, args.k, method=args.method, batch_size=args.batch_size,
+                               workers=args.workers, shard_size=args.shard_size)
+
     print(f"Processed data saved to {output_path}")
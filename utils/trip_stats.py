@@ -0,0 +1,90 @@
+# Trip length / duration statistics, kept next to every trip store as stats.json
+#
+# The statistics are additive histograms, so per-day sidecars merge into the
+# statistics of the whole corpus without another pass over the trajectories.
+import json
+import os
+
+import numpy as np
+
+DURATION_BIN = 60  # seconds per bin of the duration histogram
+PERCENTILES = [50, 90, 95, 99, 99.9]
+
+
+def compute_stats(trips, day=None):
+    """
+    Statistics of freshly segmented trips.
+
+    Args:
+        trips (dict): Trips as returned by `segment_day`.
+        day (str): Label of the day the trips come from, for the per-day counts.
+
+    Returns:
+        dict: Histograms and summary, see `summarize`.
+    """
+    lengths = np.diff(np.asarray(trips["offsets"]))
+    durations = np.asarray(trips["time_elapsed"], dtype=np.float64)
+    stats = {
+        "length_histogram": np.bincount(lengths).tolist(),
+        "duration_histogram": np.bincount((durations // DURATION_BIN).astype(np.int64)).tolist(),
+        "per_day": {} if day is None else {day: len(lengths)},
+    }
+    return summarize(stats)
+
+
+def _add_histograms(a, b):
+    total = np.zeros(max(len(a), len(b)), dtype=np.int64)
+    total[:len(a)] += np.asarray(a, dtype=np.int64)
+    total[:len(b)] += np.asarray(b, dtype=np.int64)
+    return total.tolist()
+
+
+def merge_stats(stats_list):
+    """
+    Combine the statistics of several trip stores.
+    """
+    merged = {"length_histogram": [], "duration_histogram": [], "per_day": {}}
+    for stats in stats_list:
+        merged["length_histogram"] = _add_histograms(merged["length_histogram"], stats["length_histogram"])
+        merged["duration_histogram"] = _add_histograms(merged["duration_histogram"], stats["duration_histogram"])
+        for day, count in stats["per_day"].items():
+            merged["per_day"][day] = merged["per_day"].get(day, 0) + count
+    return summarize(merged)
+
+
+def summarize(stats):
+    """
+    Fill in trip/point counts, max/mean length and length percentiles from the histograms.
+    """
+    hist = np.asarray(stats["length_histogram"], dtype=np.int64)
+    n_trips = int(hist.sum())
+    stats["n_trips"] = n_trips
+    stats["n_points"] = int((hist * np.arange(len(hist))).sum())
+    stats["duration_bin"] = DURATION_BIN
+    if n_trips == 0:
+        stats["max_length"] = 0
+        stats["mean_length"] = 0.0
+        stats["length_percentiles"] = {str(q): 0 for q in PERCENTILES}
+        return stats
+
+    stats["max_length"] = int(np.flatnonzero(hist)[-1])
+    stats["mean_length"] = stats["n_points"] / n_trips
+    # 直方图的累计分布上取分位数 (最近秩), 与对全部长度排序的结果一致
+    cumulative = np.cumsum(hist)
+    stats["length_percentiles"] = {
+        str(q): int(np.searchsorted(cumulative, np.ceil(q / 100 * n_trips))) for q in PERCENTILES
+    }
+    return stats
+
+
+def save_stats(path, stats):
+    with open(path, "w") as f:
+        json.dump(stats, f)
+
+
+def load_stats(store_path):
+    """
+    Read the stats.json sidecar of a trip store.
+    """
+    with open(os.path.join(store_path, "stats.json")) as f:
+        return json.load(f)
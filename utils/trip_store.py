@@ -0,0 +1,166 @@
+# Columnar ragged-array storage for segmented trips
+#
+# A trip store is a folder of plain .npy files:
+#   points.npy        (n_points, n_features) trajectory points of all trips, concatenated
+#   offsets.npy       (n_trips + 1,) trip k owns points[offsets[k]:offsets[k + 1]]
+#   VehicleNum.npy, start_time.npy, end_time.npy, time_elapsed.npy   one value per trip
+#   meta.json         feature names and sizes
+#   stats.json        trip length / duration statistics, see trip_stats.py
+# Every array is opened memory-mapped, so reading a slice of trips only touches its pages.
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from trip_stats import compute_stats, load_stats, merge_stats, save_stats
+
+TRIP_COLUMNS = ["VehicleNum", "start_time", "end_time", "time_elapsed"]
+
+
+def _as_storable(values):
+    # np.save refuses object arrays without pickle, vehicle ids may be strings
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+
+def write_trips(path, trips, feature, day=None):
+    """
+    Write segmented trips (as returned by `segment_day`) to a trip store folder.
+
+    Args:
+        path (str): Output folder, created if needed.
+        trips (dict): "points", "offsets" and the per-trip columns.
+        feature (list): Names of the point columns.
+        day (str): Day label recorded in the per-day counts of stats.json.
+    """
+    os.makedirs(path, exist_ok=True)
+    points = np.asarray(trips["points"], dtype=np.float64).reshape(-1, len(feature))
+    np.save(os.path.join(path, "points.npy"), points)
+    np.save(os.path.join(path, "offsets.npy"), np.asarray(trips["offsets"], dtype=np.int64))
+    for column in TRIP_COLUMNS:
+        np.save(os.path.join(path, f"{column}.npy"), _as_storable(trips[column]))
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"feature": list(feature), "n_trips": len(trips["offsets"]) - 1,
+                   "n_points": len(points)}, f)
+    save_stats(os.path.join(path, "stats.json"), compute_stats(trips, day=day))
+
+
+def merge_stores(paths, output_path):
+    """
+    Concatenate several trip stores into one, streaming through memory-mapped
+    output arrays so that only one input store is paged in at a time.
+    """
+    stores = [TripStore(path) for path in paths]
+    if not stores:
+        raise ValueError("No trip store to merge")
+    feature = stores[0].feature
+    for store in stores:
+        if store.feature != feature:
+            raise ValueError(f"Feature mismatch: {store.path} has {store.feature}, expected {feature}")
+
+    os.makedirs(output_path, exist_ok=True)
+    n_trips = sum(len(store) for store in stores)
+    n_points = sum(store.n_points for store in stores)
+
+    def open_output(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(output_path, f"{name}.npy"),
+                                         mode="w+", dtype=dtype, shape=shape)
+
+    points = open_output("points", np.float64, (n_points, len(feature)))
+    offsets = open_output("offsets", np.int64, (n_trips + 1,))
+    offsets[0] = 0
+    columns = {}
+    for column in TRIP_COLUMNS:
+        dtype = np.result_type(*[store.columns[column].dtype for store in stores])
+        columns[column] = open_output(column, dtype, (n_trips,))
+
+    trip_pos, point_pos = 0, 0
+    for store in stores:
+        n, m = len(store), store.n_points
+        points[point_pos:point_pos + m] = store.points
+        offsets[trip_pos + 1:trip_pos + n + 1] = store.offsets[1:] + point_pos
+        for column in TRIP_COLUMNS:
+            columns[column][trip_pos:trip_pos + n] = store.columns[column]
+        trip_pos += n
+        point_pos += m
+
+    for array in [points, offsets] + list(columns.values()):
+        array.flush()
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump({"feature": feature, "n_trips": n_trips, "n_points": n_points}, f)
+    save_stats(os.path.join(output_path, "stats.json"), merge_stats([store.stats() for store in stores]))
+
+
+class TripStore:
+    """
+    Read-only, memory-mapped view of a trip store folder.
+
+    Args:
+        path (str): Folder written by `write_trips` or `merge_stores`.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.feature = meta["feature"]
+        self.points = np.load(os.path.join(path, "points.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.columns = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+                        for column in TRIP_COLUMNS}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_points(self):
+        return len(self.points)
+
+    def lengths(self):
+        """
+        Number of points of every trip.
+        """
+        return np.diff(self.offsets)
+
+    def stats(self):
+        """
+        Length / duration statistics from the stats.json sidecar, recomputed
+        from the offsets for stores written without one.
+        """
+        if os.path.exists(os.path.join(self.path, "stats.json")):
+            return load_stats(self.path)
+        return compute_stats({"offsets": self.offsets, "time_elapsed": self.columns["time_elapsed"]})
+
+    def trajectory(self, k):
+        """
+        Points of trip k as an (n, n_features) array view.
+        """
+        return self.points[self.offsets[k]:self.offsets[k + 1]]
+
+    def read(self, start=0, stop=None):
+        """
+        Load trips [start, stop) into memory without touching the other trips.
+
+        Returns:
+            dict: Same layout as `segment_day`, with offsets rebased to 0.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        offsets = np.array(self.offsets[start:stop + 1])
+        trips = {column: np.array(values[start:stop]) for column, values in self.columns.items()}
+        trips["points"] = np.array(self.points[offsets[0]:offsets[-1]])
+        trips["offsets"] = offsets - offsets[0]
+        return trips
+
+    def to_frame(self, start=0, stop=None):
+        """
+        Trips [start, stop) as a DataFrame with one trajectory list per row,
+        the layout of the former results.csv files.
+        """
+        trips = self.read(start, stop)
+        points, offsets = trips["points"], trips["offsets"]
+        frame = pd.DataFrame({column: trips[column] for column in TRIP_COLUMNS})
+        frame.insert(1, "trajectory", [points[offsets[k]:offsets[k + 1]].tolist()
+                                       for k in range(len(offsets) - 1)])
+        return frame